@@ -1,9 +1,45 @@
-from typing import Tuple, List
+from functools import lru_cache
+from typing import Tuple, List, Optional
 
-import cv2
 import numpy as np
 
-from config import *
+from config import CLASSIFIER_MIN_CONFIDENCE, GEM_COLORS, PARSE_MODE, PROBE_GRID, UNKNOWN_GEM, Color, GemColor
+from gem_classifier import CentroidGemClassifier, RangeGemClassifier, create_gem_classifier
+
+
+@lru_cache(maxsize=8)
+def _get_probe_coordinates(screenshot_size: Tuple[int, int], board_size: Tuple[int, int], inner_margin: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Precompute pixel coordinates of probes in all cells - a PROBE_GRID x PROBE_GRID grid of pixels spread over the inner area of each cell.
+
+    Returns:
+        (y coordinates in shape (rows, 1, probes), x coordinates in shape (1, cols, probes)), so they can be used to index the screenshot directly
+    """
+    rows, cols = board_size
+    gem_height, gem_width = screenshot_size[0] // rows, screenshot_size[1] // cols
+    relative = np.linspace(inner_margin, 1 - inner_margin, PROBE_GRID + 2)[1:-1]  # without the borders of the inner area
+    relative_x, relative_y = np.tile(relative, PROBE_GRID), np.repeat(relative, PROBE_GRID)
+    probe_rows = (np.arange(rows)[:, np.newaxis] * gem_height + relative_y * gem_height).astype(np.intp)
+    probe_cols = (np.arange(cols)[:, np.newaxis] * gem_width + relative_x * gem_width).astype(np.intp)
+    return probe_rows[:, np.newaxis, :], probe_cols[np.newaxis, :, :]
+
+
+LEFT, RIGHT, UP, DOWN = range(4)  # directions of run lengths, index to Board.run_lengths
+
+
+def compute_run_lengths(colors: np.ndarray, backward: np.ndarray, forward: np.ndarray) -> None:
+    """
+    Compute run lengths along rows of the compact board `colors` (use transposed arrays for columns) in place - `backward[row, col]` is
+    the number of consecutive gems of the same color ending at (row, col) from the left, `forward[row, col]` the same to the right.
+    Both include the gem itself, unknown gems have run length 0. All rows are computed at once, so the loop is over columns only.
+    """
+    known = colors != UNKNOWN_GEM
+    cols = colors.shape[1]
+    backward[:, 0] = known[:, 0]
+    forward[:, cols - 1] = known[:, cols - 1]
+    for col in range(1, cols):
+        backward[:, col] = np.where(colors[:, col] == colors[:, col - 1], backward[:, col - 1] + 1, 1) * known[:, col]
+        forward[:, cols - 1 - col] = np.where(colors[:, cols - 1 - col] == colors[:, cols - col], forward[:, cols - col] + 1, 1) * known[:, cols - 1 - col]
 
 
 class Gem:
@@ -27,54 +63,120 @@ class Gem:
 
 
 class Board:
-    def __init__(self, size: Tuple[int, int]):
+    inner_margin = 0.2  # 20% margin from each side of a cell, only the inner area is used to recognize the gem
+
+    def __init__(self, size: Tuple[int, int], classifier: Optional[CentroidGemClassifier | RangeGemClassifier] = None):
         self.size: Tuple[int, int] = size
         self.grid: np.ndarray = np.empty(size, dtype=object)
+        self.confidence: np.ndarray = np.zeros(size, dtype=np.float32)  # classification confidence <0;1> of each cell
+        self.classifier = classifier or create_gem_classifier()
+        self.colors: np.ndarray = np.full(size, UNKNOWN_GEM, dtype=np.int8)  # compact board, index to GEM_COLORS (or UNKNOWN_GEM)
+        # lengths of same-color runs ending at each cell from each direction (LEFT, RIGHT, UP, DOWN), including the cell itself,
+        # so the length of a match through any cell is known without walking the board (see BoardSimulator)
+        self.run_lengths: np.ndarray = np.zeros((4, *size), dtype=np.int8)
 
     def update(self, new_state: np.ndarray) -> None:
         """Update the board with a new state."""
         if new_state.shape != self.size:
             raise ValueError("New state size does not match board size")
         self.grid = new_state
+        self._update_colors(np.array([[GEM_COLORS.index(gem.color) if gem else UNKNOWN_GEM for gem in row] for row in new_state], dtype=np.int8))
+
+    def _update_colors(self, colors: np.ndarray) -> None:
+        """Set the compact board and recompute all run lengths."""
+        self.colors = colors
+        compute_run_lengths(colors, self.run_lengths[LEFT], self.run_lengths[RIGHT])
+        compute_run_lengths(colors.T, self.run_lengths[UP].T, self.run_lengths[DOWN].T)
 
-    def update_from_screenshot(self, board_screenshot: np.ndarray) -> None:
+    def _update_run_lengths_at(self, row: int, col: int) -> None:
+        """Recompute run lengths after a change of one gem - only its row and column are affected."""
+        compute_run_lengths(self.colors[row:row + 1], self.run_lengths[LEFT, row:row + 1], self.run_lengths[RIGHT, row:row + 1])
+        compute_run_lengths(self.colors[:, col:col + 1].T, self.run_lengths[UP, :, col:col + 1].T, self.run_lengths[DOWN, :, col:col + 1].T)
+
+    def update_from_screenshot(self, board_screenshot: np.ndarray, parse_mode: str = PARSE_MODE) -> None:
         """
-        Update the board from a screenshot of the board area.
+        Update the board from a screenshot of the board area. Cells are classified by their average color, all at once.
+        Classification confidence of each cell is stored in `self.confidence`.
         
         Args:
             board_screenshot (np.ndarray): A numpy array representing the screenshot of the board area.
                                            The color order is expected to be RGB.
+            parse_mode (str): 'full' - average the whole inner area of each cell,
+                              'sparse' - average only a few probe pixels of each cell, the whole inner area is used only for cells
+                              where the probes disagree
         """
         print(f'Updating board from screenshot...')
+        if parse_mode == 'sparse':
+            average_colors, labels, self.confidence = self._classify_probes(board_screenshot)
+        elif parse_mode == 'full':
+            average_colors = self.get_cell_average_colors(board_screenshot)  # RGB order
+            labels, self.confidence = self.classifier.classify(average_colors)
+        else:
+            raise ValueError(f"Unknown parse mode '{parse_mode}', use 'sparse' or 'full'.")
+
         board_state = np.empty(self.size, dtype=object)
-        gem_width, gem_height = GEM_SIZE
-        inner_margin = 0.2  # 20% margin from each side
-
-        for row in range(BOARD_SIZE[0]):
-            for col in range(BOARD_SIZE[1]):
-                x_start = int(col * gem_width + gem_width * inner_margin)
-                x_end = int((col + 1) * gem_width - gem_width * inner_margin)
-                y_start = int(row * gem_height + gem_height * inner_margin)
-                y_end = int((row + 1) * gem_height - gem_height * inner_margin)
-
-                gem_area = board_screenshot[y_start:y_end, x_start:x_end]
-                average_color = np.mean(gem_area, axis=(0, 1))  # RGB order
-                average_color = Color(*average_color)
-
-                # Match the average color to a GemColor
-                for gem_color in GemColor:
-                    color_range = GemColorRanges[gem_color]
-                    if color_range.contains(average_color):
-                        board_state[row, col] = Gem(gem_color, (row, col))
-                        break
-                else:
-                    print(f"Warning: Unrecognized color {average_color} at position ({row}, {col})")
-                    board_state[row, col] = None
-                    if DEBUG_MODE:
-                        cv2.imshow('unknown', cv2.cvtColor(gem_area, cv2.COLOR_RGB2BGR))
-                        cv2.waitKey()
+        for (row, col), label in np.ndenumerate(labels):
+            if label == UNKNOWN_GEM:
+                print(f"Warning: Unrecognized color {Color(*average_colors[row, col])} at position ({row}, {col})")
+                board_state[row, col] = None
+            else:
+                board_state[row, col] = Gem(GEM_COLORS[label], (row, col))
 
         self.grid = board_state
+        self._update_colors(labels.astype(np.int8))
+
+    def _classify_probes(self, board_screenshot: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Classify cells by probe pixels only. The probes of each cell are split into two interleaved halves, which are classified
+        separately - if they disagree (or are not confident), the cell is classified by the average of its whole inner area instead.
+
+        Returns:
+            (average colors (rows, cols, 3), labels (rows, cols), confidence (rows, cols))
+        """
+        probe_rows, probe_cols = _get_probe_coordinates(board_screenshot.shape[:2], self.size, self.inner_margin)
+        probes = board_screenshot[probe_rows, probe_cols, :3].astype(np.float32)  # (rows, cols, probes, 3)
+        half_labels, half_confidence = self.classifier.classify(np.stack([probes[:, :, 0::2].mean(axis=2), probes[:, :, 1::2].mean(axis=2)]))
+        average_colors = probes.mean(axis=2)
+        labels, confidence = self.classifier.classify(average_colors)
+
+        unclear = (half_labels[0] != half_labels[1]) | (half_confidence.min(axis=0) < CLASSIFIER_MIN_CONFIDENCE)
+        if unclear.any():
+            unclear_positions = np.argwhere(unclear)
+            average_colors[unclear] = [self._get_cell_area(board_screenshot, row, col)[..., :3].mean(axis=(0, 1)) for row, col in unclear_positions]
+            labels[unclear], confidence[unclear] = self.classifier.classify(average_colors[unclear])
+        return average_colors, labels, confidence
+
+    def get_cell_average_colors(self, board_screenshot: np.ndarray) -> np.ndarray:
+        """Get average color of the inner area of each cell (without margins, which can contain other gems, borders etc.) as (rows, cols, 3) array."""
+        rows, cols = self.size
+        gem_width, gem_height = board_screenshot.shape[1] // cols, board_screenshot.shape[0] // rows
+        margin_x, margin_y = int(gem_width * self.inner_margin), int(gem_height * self.inner_margin)
+
+        # split the screenshot to cells (rows, gem_height, cols, gem_width, 3) and average the inner area of all cells at once
+        cells = board_screenshot[:rows * gem_height, :cols * gem_width].reshape(rows, gem_height, cols, gem_width, -1)
+        inner_area = cells[:, margin_y:gem_height - margin_y, :, margin_x:gem_width - margin_x, :3]
+        return inner_area.mean(axis=(1, 3))
+
+    def _get_cell_area(self, board_screenshot: np.ndarray, row: int, col: int) -> np.ndarray:
+        """Get the inner area of a cell (without margins)."""
+        gem_width, gem_height = board_screenshot.shape[1] // self.size[1], board_screenshot.shape[0] // self.size[0]
+        x_start = int(col * gem_width + gem_width * self.inner_margin)
+        x_end = int((col + 1) * gem_width - gem_width * self.inner_margin)
+        y_start = int(row * gem_height + gem_height * self.inner_margin)
+        y_end = int((row + 1) * gem_height - gem_height * self.inner_margin)
+        return board_screenshot[y_start:y_end, x_start:x_end]
+
+    def get_color_indices(self) -> np.ndarray:
+        """Get the compact representation of the board - index of each gem color in GEM_COLORS (or UNKNOWN_GEM), as int8 array."""
+        return self.colors
+
+    def get_low_confidence_positions(self, min_confidence: float = CLASSIFIER_MIN_CONFIDENCE) -> List[Tuple[int, int]]:
+        """
+        Get positions of ambiguous cells - recognized with lower confidence than required, i.e. roughly in between two gem colors
+        (e.g. gems captured in the middle of an animation). Unrecognized cells (e.g. special gems without centroids) are not ambiguous.
+        """
+        ambiguous = (self.confidence < min_confidence) & (self.colors != UNKNOWN_GEM)
+        return [(int(row), int(col)) for row, col in np.argwhere(ambiguous)]
 
     def get_gem(self, row: int, col: int) -> Gem:
         """Get the gem at a specific position."""
@@ -83,6 +185,8 @@ class Board:
     def set_gem(self, row: int, col: int, color: GemColor) -> None:
         """Set the gem at a specific position."""
         self.grid[row, col] = Gem(color, (row, col))
+        self.colors[row, col] = GEM_COLORS.index(color)
+        self._update_run_lengths_at(row, col)
 
     def is_valid_position(self, row: int, col: int) -> bool:
         """Check if a position is valid on the board."""
@@ -0,0 +1,69 @@
+"""
+Worker side of the multi-board mode (see multi_board.py) - parses board screenshots and searches for moves in worker processes.
+The module imports no GUI libraries, so the worker processes start fast and don't touch the screen, mouse or keyboard.
+Screenshots are passed through shared memory (SharedFrame), only its name goes through the task queue.
+"""
+from multiprocessing.shared_memory import SharedMemory
+import random
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from board import Board
+from config import BOARD_SIZE, apply_calibration
+from move_calculator import Move, MoveCalculator
+from settle_predictor import SettlePredictor
+
+
+class SharedFrame:
+    def __init__(self, shape: Tuple[int, int, int], name: Optional[str] = None):
+        """
+        A board screenshot (RGB) in shared memory. The main process creates it and copies each capture of the board into it,
+        workers attach to it by name. The main process writes it only while no task of the board is pending, so it needs no lock.
+        """
+        self.shape = tuple(shape)
+        self.is_owner = name is None
+        self.shared_memory = SharedMemory(name=name, create=self.is_owner, size=int(np.prod(self.shape)))
+        self.name = self.shared_memory.name
+        self.array = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shared_memory.buf)
+
+    def close(self) -> None:
+        self.array = None  # numpy views must be released before the shared memory can be closed
+        self.shared_memory.close()
+        if self.is_owner:
+            self.shared_memory.unlink()
+
+
+class PlanResult(NamedTuple):
+    colors: np.ndarray  # compact board, see Board.colors
+    ambiguous: bool  # some recognized cells are ambiguous between two colors (e.g. gems still falling)
+    move: Optional[Move]
+    features: Optional[np.ndarray]  # settle time features of the move, see SettlePredictor.get_features
+
+
+_worker_board: Optional[Board] = None
+_worker_move_calculator: Optional[MoveCalculator] = None
+_worker_frames: dict[str, SharedFrame] = {}  # frames attached by this worker, by name
+
+
+def init_worker() -> None:
+    """Create the board and move calculator once per worker process (the classifier setup is not repeated for every task)."""
+    global _worker_board, _worker_move_calculator
+    apply_calibration()  # spawned worker processes import the config again, without the calibration applied by the bot
+    _worker_board = Board(BOARD_SIZE)
+    _worker_move_calculator = MoveCalculator()
+
+
+def plan_board(frame_name: str, frame_shape: Tuple[int, int, int], random_move: bool) -> PlanResult:
+    """Parse the board screenshot in the shared frame and find the move to play (a random valid one if `random_move`, e.g. when the board repeats)."""
+    if frame_name not in _worker_frames:
+        _worker_frames[frame_name] = SharedFrame(frame_shape, name=frame_name)
+    board = _worker_board
+    board.update_from_screenshot(_worker_frames[frame_name].array)
+    if random_move:
+        all_moves = _worker_move_calculator.calculate_all_valid_moves(board)
+        move = random.choice(all_moves) if all_moves else None
+    else:
+        move = _worker_move_calculator.find_best_move(board)
+    features = SettlePredictor.get_features(board, move) if move else None
+    return PlanResult(board.colors, bool(board.get_low_confidence_positions()), move, features)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+from colors import Color
+
+
+class CalibrationProfile:
+    def __init__(self, board_region: Tuple[int, int, int, int], board_size: Tuple[int, int], gem_centroids: dict[str, list[Color]],
+                 source: str = '') -> None:
+        """
+        Calibration of the board geometry and gem colors, created by tools/calibrate.py from a screenshot of the game.
+        The bot loads it at startup (see config.apply_calibration) instead of the hand-measured constants.
+
+        Args:
+            board_region: (left, top, width, height) of the board on the screen
+            board_size: number of columns and rows (width, height)
+            gem_centroids: typical colors of gems, key is the GemColor value (e.g. 'red')
+            source: the screenshot the profile was created from (just for information)
+        """
+        self.board_region = tuple(board_region)
+        self.board_size = tuple(board_size)
+        self.gem_centroids = gem_centroids
+        self.source = source
+
+    def validate(self) -> None:
+        """Raise ValueError if the profile is not usable (e.g. it was edited by hand or created by an older version)."""
+        if len(self.board_region) != 4 or not all(isinstance(value, int) for value in self.board_region):
+            raise ValueError(f"Board region must be 4 integers (left, top, width, height), got {self.board_region}")
+        if self.board_region[0] < 0 or self.board_region[1] < 0 or self.board_region[2] <= 0 or self.board_region[3] <= 0:
+            raise ValueError(f"Board region {self.board_region} is not inside the screen")
+        if len(self.board_size) != 2 or not all(isinstance(value, int) and value > 0 for value in self.board_size):
+            raise ValueError(f"Board size must be 2 positive integers (columns, rows), got {self.board_size}")
+        if self.board_region[2] < self.board_size[0] or self.board_region[3] < self.board_size[1]:
+            raise ValueError(f"Board region {self.board_region} is too small for {self.board_size} gems")
+        if not any(self.gem_centroids.values()):
+            raise ValueError("There are no gem centroids in the profile")
+
+    def save(self, path: str | Path) -> None:
+        self.validate()
+        data = {
+            'board_region': list(self.board_region),
+            'board_size': list(self.board_size),
+            'gem_centroids': {name: [list(centroid.as_rgb_tuple()) for centroid in centroids] for name, centroids in self.gem_centroids.items()},
+            'source': self.source,
+        }
+        Path(path).write_text(json.dumps(data, indent=4))
+
+    @classmethod
+    def load(cls, path: str | Path) -> CalibrationProfile:
+        data = json.loads(Path(path).read_text())
+        profile = cls(
+            board_region=data['board_region'],
+            board_size=data['board_size'],
+            gem_centroids={name: [Color.from_rgb_tuple(rgb) for rgb in centroids] for name, centroids in data['gem_centroids'].items()},
+            source=data.get('source', ''),
+        )
+        profile.validate()
+        return profile
+
+    def __str__(self) -> str:
+        return f"CalibrationProfile(board_region={self.board_region}, board_size={self.board_size}, source={self.source})"
+
+
+def load_calibration(path: str | Path) -> Optional[CalibrationProfile]:
+    """Load the calibration profile, or return None if there is none (the bot is not calibrated yet)."""
+    if not Path(path).is_file():
+        return None
+    return CalibrationProfile.load(path)
@@ -1,22 +1,56 @@
 from enum import StrEnum
+from functools import cache
+from pathlib import Path
+from typing import Optional, Tuple
 
-import pyautogui
-
+from calibration import CalibrationProfile, load_calibration
 from colors import Color, ColorRange
 
-DEBUG_MODE = False  # if enabled, some debug info will be printed, some images displayed (e.g. if a screenshot is captured), etc.
+DEBUG_MODE = False  # if enabled, some debug info will be printed and the frames are shown by a viewer process (see debug_viewer.py)
+DEBUG_RING_SLOTS = 8  # number of the latest frames kept in shared memory for the debug viewer
 
 HOTKEY_START = 'f7'  # start the main loop
 HOTKEY_STOP = 'f8'  # stop the main loop
 HOTKEY_EXIT = 'esc'  # quit the program (if the main loop is not running)
 HOTKEY_KILL = 'f9'  # Emergency button: hard-kill the program including debug windows etc
+SLOW_FRAME_THRESHOLD = 1000  # [milliseconds] frames (capture, parse, search, move and settle checks, without the pauses) slower than this are profiled, see profiler.py (None to disable)
+PROFILER_SAMPLE_INTERVAL = 5  # [milliseconds] interval of stack samples of a slow frame
+PROFILES_DIR = Path(__file__).parent / 'profiles'  # profiles of slow frames are saved here
 SCREENSHOT_INTERVAL = 200  # [milliseconds] this is length of a pause after each move/screenshot (to not spam short sequences without pieces not fallen down)
+SETTLE_PREDICTION = True  # after a move, wait as long as its animation is predicted to take (instead of SCREENSHOT_INTERVAL), see settle_predictor.py
+SETTLE_MARGIN = 120  # [milliseconds] start checking whether the board is stable this long before the predicted end of the animation (a few checks, so the prediction can also learn to be shorter)
+SETTLE_CHECK_INTERVAL = 30  # [milliseconds] pause between checks whether the board is stable
+SETTLE_TIMEOUT = 3000  # [milliseconds] stop waiting for a stable board after this long
+SETTLE_LEARNING_RATE = 0.2  # how fast the predicted animation times adapt to the observed ones <0;1>
 BOARD_REGION = (220, 130, 720, 720)  # (left, top, width, height)
 BOARD_SIZE = (8, 8)  # number of columns and rows (width, height)
+MULTI_BOARD_WORKERS = 2  # multi-board mode: number of worker processes parsing the boards and searching for moves (see multi_board.py)
+CALIBRATION_FILE = Path(__file__).parent / 'calibration.json'  # created by tools/calibrate.py, overrides BOARD_REGION and GemColorCentroids
+MOVE_GENERATOR = 'run_lengths'  # 'run_lengths' (match lengths from run-length tables) or 'pattern_db' (lookups in PATTERN_DB_FILE)
+PATTERN_DB_FILE = Path(__file__).parent / 'pattern_db.npy'  # created by tools/build_pattern_db.py
+USE_NUMBA = True  # use Numba-compiled kernels of move generation and cascades if numba is installed (optional), see kernels.py
+PLANNER_ENABLED = False  # plan sequences of moves by a beam search (see planner.py) instead of the greedy find_best_move heuristic
+PLANNER_DEPTH = 3  # number of moves planned ahead
+PLANNER_BEAM_WIDTH = 8  # number of the best move sequences kept after each move
+PLANNER_OTHER_COLOR_WEIGHT = 0.1  # planner objective: value of a cleared gem of a color not in PLANNER_COLOR_WEIGHTS
 MAX_REPETITION_COUNT = 3  # if nothing is changed in the board for this many consecutive screenshots/moves, try to play another move (not the best one) to avoid being stuck
+PARSE_MODE = 'sparse'  # 'sparse' (classify cells by a few probe pixels, unclear cells by the whole inner area) or 'full' (always the whole inner area)
+PROBE_GRID = 4  # sparse parse mode: each cell is probed by a grid of PROBE_GRID x PROBE_GRID pixels
+GEM_CLASSIFIER = 'centroid'  # 'centroid' (nearest GemColorCentroids in CIELAB color space) or 'ranges' (GemColorRanges RGB boxes)
+CLASSIFIER_MAX_DISTANCE = 25.0  # [CIELAB delta E] cells farther than this from all centroids are not recognized (None)
+CLASSIFIER_MIN_CONFIDENCE = 0.3  # <0;1> if any recognized cell is classified with lower confidence (ambiguous between two colors, e.g. gems still moving), the board is captured again
+MAX_RECAPTURE_COUNT = 2  # how many times to re-capture the board at most because of low confidence cells (or until two captures agree), then the best guess is used
+RECAPTURE_INTERVAL = 50  # [milliseconds] pause before re-capturing the board
 
 GEM_SIZE = (BOARD_REGION[2] // BOARD_SIZE[0], BOARD_REGION[3] // BOARD_SIZE[1])  # width, height
-SCREEN_WIDTH, SCREEN_HEIGHT = pyautogui.size()
+
+
+@cache
+def get_screen_size() -> Tuple[int, int]:
+    """Return (width, height) of the screen. pyautogui is imported only when needed, because it initializes GUI libraries."""
+    import pyautogui
+    width, height = pyautogui.size()
+    return width, height
 
 
 class GemColor(StrEnum):
@@ -34,6 +68,10 @@ class GemColor(StrEnum):
     pink_special = 'pink_special'
 
 
+GEM_COLORS = tuple(GemColor)  # compact representation of gem colors - index of a color in this tuple (used in numpy arrays)
+UNKNOWN_GEM = -1  # compact representation of an unrecognized gem (None)
+
+
 GemColorRanges = {
     GemColor.red: ColorRange(Color(170, 60, 40), Color(200, 90, 60)),
     GemColor.red_special: ColorRange(Color(0, 0, 0), Color(0, 0, 0)),
@@ -49,16 +87,78 @@ GemColorRanges = {
     GemColor.pink_special: ColorRange(Color(0, 0, 0), Color(0, 0, 0))
 }
 
+# Typical (average) colors of each gem, used by the 'centroid' classifier. Multiple centroids per gem are allowed (e.g. a special gem with
+# a glowing animation). An empty list means the gem is not measured yet and can not be recognized - special gems are not measured here,
+# run tools/calibrate.py on a screenshot with special gems on the board (they are derived from cells far from all base colors).
+GemColorCentroids = {
+    GemColor.red: [Color(185, 75, 50)],
+    GemColor.red_special: [],
+    GemColor.dark_red: [Color(70, 25, 30)],
+    GemColor.dark_red_special: [],
+    GemColor.blue: [Color(75, 88, 165)],
+    GemColor.blue_special: [],
+    GemColor.turquoise: [Color(70, 150, 155)],
+    GemColor.turquoise_special: [],
+    GemColor.yellow: [Color(203, 158, 115)],
+    GemColor.yellow_special: [],
+    GemColor.pink: [Color(155, 90, 168)],
+    GemColor.pink_special: []
+}
+
+# planner objective: value of a cleared gem of each target color (e.g. deplete red gems first), see PLANNER_OTHER_COLOR_WEIGHT for other colors
+PLANNER_COLOR_WEIGHTS = {
+    GemColor.red: 1.0,
+    GemColor.red_special: 1.0,
+}
+
+# multi-board mode (see multi_board.py): (left, top, width, height) regions of all game clients played at once, all boards have BOARD_SIZE
+BOARD_REGIONS = [BOARD_REGION]
+
+CALIBRATION: Optional[CalibrationProfile] = None  # the applied calibration profile, see apply_calibration
+
+
+@cache
+def apply_calibration() -> Optional[CalibrationProfile]:
+    """
+    Use the calibration profile instead of the hand-measured values above (if the bot was calibrated, see tools/calibrate.py).
+    Not run on import (a stale profile must not break the calibration tools), but once by the bot at startup and by its worker processes.
+    """
+    global CALIBRATION, BOARD_REGION, GEM_SIZE
+    profile = load_calibration(CALIBRATION_FILE)
+    if profile:
+        if profile.board_size != BOARD_SIZE:
+            raise ValueError(f"Calibration {CALIBRATION_FILE} is for board size {profile.board_size}, but BOARD_SIZE is {BOARD_SIZE}. Please calibrate again.")
+        if BOARD_REGIONS == [BOARD_REGION]:
+            BOARD_REGIONS[:] = [profile.board_region]  # single board, the list is shared by the modules which imported it
+        BOARD_REGION = profile.board_region
+        GEM_SIZE = (BOARD_REGION[2] // BOARD_SIZE[0], BOARD_REGION[3] // BOARD_SIZE[1])
+        GemColorCentroids.update({GemColor(name): centroids for name, centroids in profile.gem_centroids.items()})
+    CALIBRATION = profile
+    return profile
+
 
 ################################################## AUTOMATED CHECKS ##################################################
-# check that all gem colors are defined in GemColorRange
-if len(GemColorRanges) != len(GemColor):
-    raise ValueError(f"Not all gem colors are defined in GemColorRange. Please fix the GemColorRange in {__file__}.")
-
-# check that no two gem colors have overlapping ranges, because then the color detection would not work properly
-for color_range in GemColorRanges.values():
-    for other_color_range in GemColorRanges.values():
-        if color_range == other_color_range:
-            continue
-        if color_range.has_intersection(other_color_range):
-            raise ValueError(f"Color range {color_range} has intersection with {other_color_range}. Please fix the color ranges in {__file__}.")
+@cache
+def validate_config() -> None:
+    """Check the config for mistakes. Not run on import (so tools and worker processes import the config instantly), but once by the bot at startup."""
+    # check that all gem colors are defined in GemColorRange
+    if len(GemColorRanges) != len(GemColor):
+        raise ValueError(f"Not all gem colors are defined in GemColorRange. Please fix the GemColorRange in {__file__}.")
+
+    # check that all gem colors are defined in GemColorCentroids
+    if len(GemColorCentroids) != len(GemColor):
+        raise ValueError(f"Not all gem colors are defined in GemColorCentroids. Please fix the GemColorCentroids in {__file__}.")
+
+    # check that no two gem colors have overlapping ranges, because then the color detection would not work properly
+    for color_range in GemColorRanges.values():
+        for other_color_range in GemColorRanges.values():
+            if color_range == other_color_range:
+                continue
+            if color_range.has_intersection(other_color_range):
+                raise ValueError(f"Color range {color_range} has intersection with {other_color_range}. Please fix the color ranges in {__file__}.")
+
+    # check that no two boards overlap, because then a move on one board would be played on the other one too
+    for index, (left, top, width, height) in enumerate(BOARD_REGIONS):
+        for other_left, other_top, other_width, other_height in BOARD_REGIONS[index + 1:]:
+            if left < other_left + other_width and other_left < left + width and top < other_top + other_height and other_top < top + height:
+                raise ValueError(f"Board regions {BOARD_REGIONS[index]} and {(other_left, other_top, other_width, other_height)} overlap. Please fix BOARD_REGIONS in {__file__}.")
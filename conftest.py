@@ -0,0 +1 @@
+# marks the repository root for pytest, so the tests can import the bot modules
@@ -0,0 +1,149 @@
+"""
+Non-blocking debug visualization. The bot publishes the latest frames (screenshot, recognized gems, confidence and the chosen move)
+to a fixed-size ring buffer in shared memory and a separate viewer process renders them, so debugging does not change the timing
+of the bot (unlike cv2.imshow + cv2.waitKey in the main loop).
+"""
+from multiprocessing import Event, Process
+from multiprocessing.shared_memory import SharedMemory
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from config import CLASSIFIER_MIN_CONFIDENCE, DEBUG_RING_SLOTS, GEM_COLORS, UNKNOWN_GEM
+
+NO_MOVE = (-1, -1, -1, -1)
+
+
+def _get_slot_dtype(frame_shape: Tuple[int, int, int], board_size: Tuple[int, int]) -> np.dtype:
+    return np.dtype([
+        ('sequence', np.int64),  # odd while the slot is being written (seqlock), so the reader can detect a torn read
+        ('timestamp', np.float64),
+        ('frame', np.uint8, frame_shape),  # RGB
+        ('labels', np.int8, board_size),  # index to GEM_COLORS or UNKNOWN_GEM
+        ('confidence', np.float32, board_size),
+        ('move', np.int16, (4,)),  # row1, col1, row2, col2 or NO_MOVE
+    ], align=True)
+
+
+class DebugFrameRing:
+    def __init__(self, frame_shape: Tuple[int, int, int], board_size: Tuple[int, int], slots: int = DEBUG_RING_SLOTS, name: Optional[str] = None):
+        """
+        Ring buffer of debug frames in shared memory. The writer (bot) creates it, the reader (viewer) attaches to it by name.
+        The writer never waits for the reader, the reader just skips frames it was too slow to render.
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.board_size = tuple(board_size)
+        self.slot_count = slots
+        self.is_owner = name is None
+        slot_dtype = _get_slot_dtype(self.frame_shape, self.board_size)
+        counter_size = np.dtype(np.int64).itemsize
+        self.shared_memory = SharedMemory(name=name, create=self.is_owner, size=counter_size + slots * slot_dtype.itemsize)
+        self.name = self.shared_memory.name
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=self.shared_memory.buf)  # number of published frames
+        self.slots = np.ndarray((slots,), dtype=slot_dtype, buffer=self.shared_memory.buf, offset=counter_size)
+        if self.is_owner:
+            self.counter[0] = 0
+            self.slots['sequence'] = 0
+
+    def publish(self, frame: np.ndarray, labels: np.ndarray, confidence: np.ndarray, move: Tuple[int, int, int, int] = NO_MOVE) -> None:
+        """Write a frame to the oldest slot. Frames of a different size than the ring (e.g. a partial screenshot) are ignored."""
+        if frame.shape != self.frame_shape:
+            return
+        count = int(self.counter[0])
+        slot = self.slots[count % self.slot_count]
+        slot['sequence'] = 2 * count + 1
+        slot['timestamp'] = time.time()
+        slot['frame'] = frame
+        slot['labels'] = labels
+        slot['confidence'] = confidence
+        slot['move'] = move
+        slot['sequence'] = 2 * count + 2
+        self.counter[0] = count + 1
+
+    def read_latest(self) -> Optional[Tuple[int, np.void]]:
+        """Return (frame number, copy of the slot) of the latest published frame, or None if there is none or it is being overwritten."""
+        count = int(self.counter[0])
+        if count == 0:
+            return None
+        slot = self.slots[(count - 1) % self.slot_count]
+        sequence = int(slot['sequence'])
+        if sequence != 2 * count:
+            return None  # being written right now
+        data = slot.copy()
+        if int(slot['sequence']) != sequence:
+            return None  # overwritten while copying
+        return count, data
+
+    def close(self) -> None:
+        # numpy views must be released before the shared memory can be closed
+        self.counter = None
+        self.slots = None
+        self.shared_memory.close()
+        if self.is_owner:
+            self.shared_memory.unlink()
+
+
+def _render(data: np.void, frame_number: int) -> np.ndarray:
+    import cv2
+
+    image = cv2.cvtColor(data['frame'], cv2.COLOR_RGB2BGR)
+    rows, cols = data['labels'].shape
+    gem_width, gem_height = image.shape[1] // cols, image.shape[0] // rows
+    for (row, col), label in np.ndenumerate(data['labels']):
+        confidence = float(data['confidence'][row, col])
+        top_left = (col * gem_width, row * gem_height)
+        bottom_right = ((col + 1) * gem_width - 1, (row + 1) * gem_height - 1)
+        if label == UNKNOWN_GEM or confidence < CLASSIFIER_MIN_CONFIDENCE:
+            cv2.rectangle(image, top_left, bottom_right, (0, 0, 255), 2)
+        name = 'None' if label == UNKNOWN_GEM else str(GEM_COLORS[label])
+        cv2.putText(image, name[:9], (top_left[0] + 3, top_left[1] + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        cv2.putText(image, f'{confidence:.2f}', (top_left[0] + 3, bottom_right[1] - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+
+    row1, col1, row2, col2 = (int(value) for value in data['move'])
+    if row1 >= 0:
+        start = (int((col1 + 0.5) * gem_width), int((row1 + 0.5) * gem_height))
+        end = (int((col2 + 0.5) * gem_width), int((row2 + 0.5) * gem_height))
+        cv2.arrowedLine(image, start, end, (0, 255, 0), 3, tipLength=0.3)
+
+    age = (time.time() - float(data['timestamp'])) * 1000
+    cv2.putText(image, f'frame {frame_number}, {age:.0f} ms old', (5, image.shape[0] - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+    return image
+
+
+def run_viewer(name: str, frame_shape: Tuple[int, int, int], board_size: Tuple[int, int], slots: int, stop_event: Event) -> None:
+    """Viewer process - render the latest frame of the ring until the bot stops (or the window is closed by ESC)."""
+    import cv2
+
+    ring = DebugFrameRing(frame_shape, board_size, slots, name=name)
+    window_name = 'debug viewer'
+    last_frame_number = 0
+    try:
+        while not stop_event.is_set():
+            latest = ring.read_latest()
+            if latest and latest[0] != last_frame_number:
+                last_frame_number, data = latest
+                cv2.imshow(window_name, _render(data, last_frame_number))
+            if cv2.waitKey(30) & 0xFF == 27:  # ESC key
+                break
+    finally:
+        ring.close()
+        cv2.destroyAllWindows()
+
+
+class DebugViewer:
+    def __init__(self, frame_shape: Tuple[int, int, int], board_size: Tuple[int, int], slots: int = DEBUG_RING_SLOTS):
+        """Create the shared ring buffer and start the viewer process rendering it."""
+        self.ring = DebugFrameRing(frame_shape, board_size, slots)
+        self.stop_event = Event()
+        self.process = Process(target=run_viewer, args=(self.ring.name, self.ring.frame_shape, self.ring.board_size, slots, self.stop_event),
+                               daemon=True)
+        self.process.start()
+
+    def publish(self, frame: np.ndarray, labels: np.ndarray, confidence: np.ndarray, move: Tuple[int, int, int, int] = NO_MOVE) -> None:
+        self.ring.publish(frame, labels, confidence, move)
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.process.join(timeout=1)
+        self.ring.close()
@@ -0,0 +1,90 @@
+from typing import Tuple
+
+import numpy as np
+
+from colors import Color, ColorRange
+from config import CLASSIFIER_MAX_DISTANCE, GEM_CLASSIFIER, GEM_COLORS, UNKNOWN_GEM, GemColor, GemColorCentroids, GemColorRanges
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert an array of RGB colors (..., 3) with values <0;255> to CIELAB (D65 white point). Differences in CIELAB are close to how
+    differently the colors are perceived, unlike RGB."""
+    rgb = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ np.array([[0.4124, 0.2126, 0.0193],
+                             [0.3576, 0.7152, 0.1192],
+                             [0.1805, 0.0722, 0.9505]], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)  # normalize by the white point
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    lightness = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([lightness, a, b], axis=-1)
+
+
+class CentroidGemClassifier:
+    def __init__(self, centroids: dict[GemColor, list[Color]] = GemColorCentroids, max_distance: float = CLASSIFIER_MAX_DISTANCE):
+        """
+        Classify gems by the nearest centroid (typical color of a gem) in CIELAB color space. A gem can have more centroids,
+        then the closest one is used. Gems without any centroid can't be recognized.
+        """
+        self.max_distance = max_distance
+        # centroids are sorted by gem color, so distances can be reduced per color by np.minimum.reduceat
+        self.labels = np.array([GEM_COLORS.index(color) for color in GEM_COLORS if centroids[color]], dtype=np.int8)
+        rgb_centroids = [centroid.as_rgb_tuple() for color in GEM_COLORS for centroid in centroids[color]]
+        counts = [len(centroids[color]) for color in GEM_COLORS if centroids[color]]
+        self.label_starts = np.cumsum([0] + counts[:-1])
+        self.lab_centroids = rgb_to_lab(np.array(rgb_centroids, dtype=np.float32))
+
+    def classify(self, colors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify an array of RGB colors (..., 3), e.g. average colors of all cells (rows, cols, 3), in one vectorized pass.
+
+        Returns:
+            Tuple of labels (index to GEM_COLORS, or UNKNOWN_GEM) and confidence <0;1> of each label, both in shape (...).
+            The confidence is 1 - (distance to nearest gem color / distance to second nearest gem color), so it is close to 0
+            if the color is roughly in between two gem colors.
+        """
+        lab = rgb_to_lab(colors).reshape(-1, 1, 3)
+        distances = np.linalg.norm(lab - self.lab_centroids[np.newaxis], axis=2)
+        distances = np.minimum.reduceat(distances, self.label_starts, axis=1)  # nearest centroid of each gem color
+
+        nearest = np.argmin(distances, axis=1)
+        nearest_distance = np.take_along_axis(distances, nearest[:, np.newaxis], axis=1)[:, 0]
+        if distances.shape[1] > 1:
+            second_distance = np.partition(distances, 1, axis=1)[:, 1]
+            confidence = 1 - nearest_distance / np.maximum(second_distance, 1e-6)
+        else:
+            confidence = np.ones_like(nearest_distance)
+
+        labels = self.labels[nearest]
+        unknown = nearest_distance > self.max_distance
+        labels[unknown] = UNKNOWN_GEM
+        confidence[unknown] = 0
+        shape = colors.shape[:-1]
+        return labels.reshape(shape), confidence.astype(np.float32).reshape(shape)
+
+
+class RangeGemClassifier:
+    def __init__(self, color_ranges: dict[GemColor, ColorRange] = GemColorRanges):
+        """Classify gems by hand-tuned RGB boxes. The confidence is 1 for recognized gems and 0 for unrecognized ones."""
+        self.labels = np.array([GEM_COLORS.index(color) for color in GEM_COLORS], dtype=np.int8)
+        self.min_rgb = np.array([color_ranges[color].min_rgb.as_rgb_tuple() for color in GEM_COLORS], dtype=np.float32)
+        self.max_rgb = np.array([color_ranges[color].max_rgb.as_rgb_tuple() for color in GEM_COLORS], dtype=np.float32)
+
+    def classify(self, colors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Classify an array of RGB colors (..., 3). Returns labels (index to GEM_COLORS, or UNKNOWN_GEM) and confidence in shape (...)."""
+        rgb = np.round(np.asarray(colors, dtype=np.float32)).reshape(-1, 1, 3)
+        inside = np.all((self.min_rgb <= rgb) & (rgb <= self.max_rgb), axis=2)
+        recognized = inside.any(axis=1)
+        labels = np.where(recognized, self.labels[np.argmax(inside, axis=1)], UNKNOWN_GEM).astype(np.int8)
+        shape = colors.shape[:-1]
+        return labels.reshape(shape), recognized.astype(np.float32).reshape(shape)
+
+
+def create_gem_classifier(mode: str = GEM_CLASSIFIER) -> CentroidGemClassifier | RangeGemClassifier:
+    if mode == 'centroid':
+        return CentroidGemClassifier()
+    elif mode == 'ranges':
+        return RangeGemClassifier()
+    raise ValueError(f"Unknown gem classifier '{mode}', use 'centroid' or 'ranges'.")
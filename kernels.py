@@ -0,0 +1,163 @@
+"""
+Kernels of move generation and cascade simulation on the compact board (int8 array of indices to GEM_COLORS, see Board.colors).
+
+Each kernel has a NumPy reference implementation and an implementation with plain loops, which is compiled by Numba if it is
+installed (optional dependency) and USE_NUMBA is enabled. Cascades are branchy per-column work, which NumPy handles poorly, so the
+compiled kernels are much faster. Compiled code is cached on disk (cache=True), so only the first launch pays for the compilation.
+Both implementations are checked to give identical results by tests/test_kernels.py.
+"""
+import numpy as np
+
+from board import DOWN, LEFT, RIGHT, UP, compute_run_lengths
+from config import UNKNOWN_GEM, USE_NUMBA
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def match_counts_numpy(colors: np.ndarray, run_lengths: np.ndarray, rows: np.ndarray, cols: np.ndarray, swap_colors: np.ndarray,
+                       swapped_rows: np.ndarray, swapped_cols: np.ndarray) -> np.ndarray:
+    """Number of gems matched by gems of `swap_colors` moved to (rows, cols) by swaps with (swapped_rows, swapped_cols), see BoardSimulator.get_match_count."""
+    # pad the board by one unknown cell on each side, so neighbors of border cells can be indexed too
+    padded_colors = np.pad(colors, 1, constant_values=UNKNOWN_GEM)
+    padded_runs = np.pad(run_lengths, ((0, 0), (1, 1), (1, 1)))
+    rows, cols = rows + 1, cols + 1
+    swapped_rows, swapped_cols = swapped_rows + 1, swapped_cols + 1
+
+    extensions = np.zeros((4, *rows.shape), dtype=np.int8)
+    for direction, (row_offset, col_offset) in ((LEFT, (0, -1)), (RIGHT, (0, 1)), (UP, (-1, 0)), (DOWN, (1, 0))):
+        neighbor_rows, neighbor_cols = rows + row_offset, cols + col_offset
+        continues = (padded_colors[neighbor_rows, neighbor_cols] == swap_colors) & ((neighbor_rows != swapped_rows) | (neighbor_cols != swapped_cols))
+        extensions[direction] = np.where(continues, padded_runs[direction, neighbor_rows, neighbor_cols], 0)
+    horizontal = 1 + extensions[LEFT] + extensions[RIGHT]
+    vertical = 1 + extensions[UP] + extensions[DOWN]
+
+    # swap of two gems of the same color does not change the board
+    same = padded_colors[rows, cols] == swap_colors
+    runs = padded_runs[:, rows, cols]
+    horizontal = np.where(same, runs[LEFT] + runs[RIGHT] - 1, horizontal)
+    vertical = np.where(same, runs[UP] + runs[DOWN] - 1, vertical)
+
+    return np.where((horizontal >= 3) & (vertical >= 3), horizontal + vertical - 1,
+                    np.where(horizontal >= 3, horizontal, np.where(vertical >= 3, vertical, 0))).astype(np.int8)
+
+
+def match_counts_loops(colors: np.ndarray, run_lengths: np.ndarray, rows: np.ndarray, cols: np.ndarray, swap_colors: np.ndarray,
+                       swapped_rows: np.ndarray, swapped_cols: np.ndarray) -> np.ndarray:
+    """The same as match_counts_numpy, written with loops for Numba."""
+    board_rows, board_cols = colors.shape
+    counts = np.zeros(len(rows), dtype=np.int8)
+    for index in range(len(rows)):
+        row, col, color = rows[index], cols[index], swap_colors[index]
+        if colors[row, col] == color:
+            horizontal = run_lengths[LEFT, row, col] + run_lengths[RIGHT, row, col] - 1
+            vertical = run_lengths[UP, row, col] + run_lengths[DOWN, row, col] - 1
+        else:
+            horizontal = 1
+            vertical = 1
+            if col > 0 and colors[row, col - 1] == color and not (row == swapped_rows[index] and col - 1 == swapped_cols[index]):
+                horizontal += run_lengths[LEFT, row, col - 1]
+            if col < board_cols - 1 and colors[row, col + 1] == color and not (row == swapped_rows[index] and col + 1 == swapped_cols[index]):
+                horizontal += run_lengths[RIGHT, row, col + 1]
+            if row > 0 and colors[row - 1, col] == color and not (row - 1 == swapped_rows[index] and col == swapped_cols[index]):
+                vertical += run_lengths[UP, row - 1, col]
+            if row < board_rows - 1 and colors[row + 1, col] == color and not (row + 1 == swapped_rows[index] and col == swapped_cols[index]):
+                vertical += run_lengths[DOWN, row + 1, col]
+
+        if horizontal >= 3 and vertical >= 3:
+            counts[index] = horizontal + vertical - 1
+        elif horizontal >= 3:
+            counts[index] = horizontal
+        elif vertical >= 3:
+            counts[index] = vertical
+    return counts
+
+
+def resolve_cascade_numpy(colors: np.ndarray, cleared_by_color: np.ndarray, cleared_by_column: np.ndarray) -> int:
+    """
+    Repeatedly clear all matches (3 or more gems of the same color in a row/column) and let the gems above fall down, until there
+    are no matches. The board is modified in place, refilled cells are unknown (they never match). Numbers of cleared gems
+    are added to `cleared_by_color` (index to GEM_COLORS) and `cleared_by_column`.
+
+    Returns:
+        depth of the cascade - number of steps with any match (0 if there is no match on the board)
+    """
+    rows, cols = colors.shape
+    run_lengths = np.zeros((4, rows, cols), dtype=np.int8)
+    depth = 0
+    while True:
+        compute_run_lengths(colors, run_lengths[LEFT], run_lengths[RIGHT])
+        compute_run_lengths(colors.T, run_lengths[UP].T, run_lengths[DOWN].T)
+        cleared = (run_lengths[LEFT] + run_lengths[RIGHT] > 3) | (run_lengths[UP] + run_lengths[DOWN] > 3)  # run through the cell >= 3
+        if not cleared.any():
+            return depth
+        depth += 1
+        cleared_by_color += np.bincount(colors[cleared], minlength=len(cleared_by_color))
+        cleared_by_column += cleared.sum(axis=0)
+
+        # gravity - cleared cells move to the top of each column (stable, so the other gems keep their order) and are refilled
+        order = np.argsort(~cleared, axis=0, kind='stable')
+        colors[:] = np.take_along_axis(colors, order, axis=0)
+        colors[np.arange(rows)[:, np.newaxis] < cleared.sum(axis=0)] = UNKNOWN_GEM
+
+
+def resolve_cascade_loops(colors: np.ndarray, cleared_by_color: np.ndarray, cleared_by_column: np.ndarray) -> int:
+    """The same as resolve_cascade_numpy, written with loops for Numba."""
+    rows, cols = colors.shape
+    cleared = np.zeros((rows, cols), dtype=np.bool_)
+    depth = 0
+    while True:
+        cleared[:, :] = False
+        found = False
+        for row in range(rows):
+            start = 0
+            while start < cols:
+                end = start + 1
+                while end < cols and colors[row, end] == colors[row, start]:
+                    end += 1
+                if colors[row, start] != UNKNOWN_GEM and end - start >= 3:
+                    cleared[row, start:end] = True
+                    found = True
+                start = end
+        for col in range(cols):
+            start = 0
+            while start < rows:
+                end = start + 1
+                while end < rows and colors[end, col] == colors[start, col]:
+                    end += 1
+                if colors[start, col] != UNKNOWN_GEM and end - start >= 3:
+                    cleared[start:end, col] = True
+                    found = True
+                start = end
+        if not found:
+            return depth
+        depth += 1
+
+        for col in range(cols):
+            target = rows - 1  # gems fall from the bottom up, rows are read before they are overwritten
+            for row in range(rows - 1, -1, -1):
+                if cleared[row, col]:
+                    cleared_by_color[colors[row, col]] += 1
+                    cleared_by_column[col] += 1
+                else:
+                    colors[target, col] = colors[row, col]
+                    target -= 1
+            for row in range(target, -1, -1):
+                colors[row, col] = UNKNOWN_GEM
+
+
+if numba is not None and USE_NUMBA:
+    match_counts = numba.njit(cache=True)(match_counts_loops)
+    resolve_cascade = numba.njit(cache=True)(resolve_cascade_loops)
+else:
+    match_counts = match_counts_numpy
+    resolve_cascade = resolve_cascade_numpy
+
+
+def simulate_swap(colors: np.ndarray, row1: int, col1: int, row2: int, col2: int, cleared_by_color: np.ndarray, cleared_by_column: np.ndarray) -> int:
+    """Swap two gems of the compact board (in place) and resolve the cascade, see resolve_cascade. Returns the depth of the cascade."""
+    colors[row1, col1], colors[row2, col2] = colors[row2, col2], colors[row1, col1]
+    return resolve_cascade(colors, cleared_by_color, cleared_by_column)
+
@@ -18,17 +18,22 @@
 from contextlib import suppress
 from enum import StrEnum
 import random
-import mss
-import cv2
-import mss.screenshot
 import numpy as np
 import time
+from typing import Callable, Optional, Tuple
 from board import Board
+from debug_viewer import NO_MOVE, DebugViewer
 from move_calculator import MoveCalculator
 from move_executor import MoveExecutor
+from multi_board import multi_board_loop
+from planner import BeamPlanner
+from profiler import SlowFrameProfiler
+from settle_predictor import SettlePredictor
+import config
 from config import *
 from threading import Event
-from hotkeys import add_hotkey, start_listening, stop_listening
+# GUI libraries (mss, cv2, pynput) are imported on first use - worker processes of the multi-board mode import this module again
+# on platforms which spawn them (Windows), and they must not load the GUI libraries
 
 
 run_condition = Event()  # used to start/stop the game execution loop
@@ -42,12 +47,37 @@ def capture_board_screenshot() -> np.ndarray:
     # full_screenshot = cv2.cvtColor(full_screenshot, cv2.COLOR_BGR2RGB)
     # return full_screenshot[BOARD_REGION[1]:BOARD_REGION[1]+BOARD_REGION[3], BOARD_REGION[0]:BOARD_REGION[0]+BOARD_REGION[2]]
 
+    import mss
+    import mss.screenshot
+
     with mss.mss() as sct:
-        region = {'top': BOARD_REGION[1], 'left': BOARD_REGION[0], 'width': BOARD_REGION[2], 'height': BOARD_REGION[3]}
+        left, top, width, height = config.BOARD_REGION  # read at call time, the calibration is applied at startup
+        region = {'top': top, 'left': left, 'width': width, 'height': height}
         screenshot: mss.screenshot.ScreenShot = sct.grab(region)  # ScreenShot object
-        np_screenshot = np.array(screenshot)
-        rgb_screenshot = cv2.cvtColor(np_screenshot, cv2.COLOR_BGR2RGB)
-        return rgb_screenshot
+        # view of the raw BGRA pixels without any copy/conversion, reversed channels give RGB order (parsing reads only a few pixels anyway)
+        bgra_screenshot = np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+        return bgra_screenshot[..., 2::-1]
+
+def wait_until_settled(board: Board, move_end: float, predicted: float, sleep: Callable[[float], None] = time.sleep) -> Tuple[float, Optional[np.ndarray]]:
+    """
+    Sleep until just before the predicted end of the move animation, then check the board (sparse parse) until two consecutive
+    captures are the same (unknown cells included - e.g. a special gem stays unknown on a stable board). Returns the observed
+    time [seconds] from the end of the move until the board was stable, and the last screenshot the board is parsed from (None if
+    the board was not stable until SETTLE_TIMEOUT). The pauses are slept by `sleep` (e.g. SlowFrameProfiler.sleep).
+    Note: the observed time can't be shorter than the first check (SETTLE_MARGIN before the prediction), so a too long prediction
+    shrinks by at most SETTLE_LEARNING_RATE * SETTLE_MARGIN per move - the margin spans a few checks to keep this bias small.
+    """
+    sleep(max(move_end + predicted - SETTLE_MARGIN / 1000 - time.perf_counter(), 0))
+    previous_colors, previous_time = None, time.perf_counter()
+    while time.perf_counter() - move_end < SETTLE_TIMEOUT / 1000:
+        capture_time = time.perf_counter()
+        screenshot = capture_board_screenshot()
+        board.update_from_screenshot(screenshot, parse_mode='sparse')
+        if previous_colors is not None and np.array_equal(board.colors, previous_colors):
+            return previous_time - move_end, screenshot
+        previous_colors, previous_time = board.colors, capture_time
+        sleep(SETTLE_CHECK_INTERVAL / 1000)
+    return previous_time - move_end, None
 
 def main_loop():
     board = Board(BOARD_SIZE)
@@ -55,46 +85,102 @@ def main_loop():
     move_executor = MoveExecutor()
     sleep_time = SCREENSHOT_INTERVAL / 1000  # seconds
     repetition_count = 0  # how many times the board has not changed (best move is probably not working)
-    previous_board_grid = board.grid  # empty grid
+    previous_colors = None  # the board of the previous played (or skipped) turn
+    recapture_count = 0  # how many times in a row the board was captured again because of low confidence cells
+    recapture_colors = None  # the board of the previous capture with low confidence cells
+    settle_predictor = SettlePredictor()
+    planner = BeamPlanner() if PLANNER_ENABLED else None
+    debug_viewer: DebugViewer | None = None  # renders frames in another process, so debugging doesn't change the timing of the bot
+    profiler = SlowFrameProfiler()  # dumps frames slower than SLOW_FRAME_THRESHOLD
+    settled_screenshot = None  # the stable board after the last move, captured and parsed by wait_until_settled
 
     print("Starting main loop...")
-    while run_condition.is_set():
-        screenshot = capture_board_screenshot()
-        if DEBUG_MODE:
-            print("Captured new screenshot, showing it...")
-            cv2.imshow('screenshot', cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR))
-            cv2.waitKey()
-
-        board.update_from_screenshot(screenshot)
-        if DEBUG_MODE:
-            print(board)
-
-        # check for repetitions to avoid being stuck in an endless loop if the best move is invalid and does nothing (can't be played)
-        if np.array_equal(board.grid, previous_board_grid):
-            repetition_count += 1
-        else:
-            repetition_count = 0
-        previous_board_grid = board.grid
-        if repetition_count >= MAX_REPETITION_COUNT:
-            print("Repetition detected. Trying to find a different move...")
-            all_moves = move_calculator.calculate_all_valid_moves(board)
-            best_move = random.choice(all_moves) if all_moves else None
-        else:
-            best_move = move_calculator.find_best_move(board)
-
-        if best_move:
-            print(f"Executing move: {best_move}")
-            move_executor.execute_move(best_move)
-        else:
-            print("No valid moves found. Skipping this turn...")
-
-        time.sleep(sleep_time)
+    try:
+        while run_condition.is_set():
+            profiler.start_frame()
+            # the next turn starts from the stable board after the move, instead of capturing and parsing it once more
+            reuse_settled = settled_screenshot is not None
+            screenshot = settled_screenshot if reuse_settled else capture_board_screenshot()
+            settled_screenshot = None
+            profiler.mark('capture')
+            if not reuse_settled or PARSE_MODE != 'sparse':  # the settle checks parse sparsely
+                board.update_from_screenshot(screenshot)
+            profiler.mark('parse')
+            profiler.set_input(screenshot, board)
+            if DEBUG_MODE and debug_viewer is None:
+                debug_viewer = DebugViewer(screenshot.shape, board.size)  # the size of the board screenshot is known from now on
+
+            # some cells are not recognized reliably (e.g. gems still falling), capture the board again instead of playing a wrong move
+            # (unless the capture is the same as the previous one - the cells are ambiguous even on a stable board)
+            low_confidence_positions = board.get_low_confidence_positions()
+            if low_confidence_positions and recapture_count < MAX_RECAPTURE_COUNT and not np.array_equal(board.colors, recapture_colors):
+                recapture_count += 1
+                recapture_colors = board.colors
+                print(f"Low confidence cells {low_confidence_positions}, capturing the board again...")
+                if debug_viewer:
+                    debug_viewer.publish(screenshot, board.get_color_indices(), board.confidence)
+                profiler.end_frame()
+                time.sleep(RECAPTURE_INTERVAL / 1000)
+                continue
+            recapture_count = 0
+            recapture_colors = None
+            if DEBUG_MODE:
+                print(board)
+
+            # check for repetitions to avoid being stuck in an endless loop if the best move is invalid and does nothing (can't be played)
+            if previous_colors is not None and np.array_equal(board.colors, previous_colors):
+                repetition_count += 1
+            else:
+                repetition_count = 0
+            previous_colors = board.colors
+            if repetition_count >= MAX_REPETITION_COUNT:
+                print("Repetition detected. Trying to find a different move...")
+                all_moves = move_calculator.calculate_all_valid_moves(board)
+                best_move = random.choice(all_moves) if all_moves else None
+            else:
+                best_move = planner.get_move(board) if planner else move_calculator.find_best_move(board)
+            profiler.mark('search')
+
+            if debug_viewer:
+                move = (*best_move.gem1.position, *best_move.gem2.position) if best_move else NO_MOVE
+                debug_viewer.publish(screenshot, board.get_color_indices(), board.confidence, move)
+
+            if best_move and SETTLE_PREDICTION:
+                print(f"Executing move: {best_move}")
+                features = settle_predictor.get_features(board, best_move)  # simulated outcome of the move
+                move_executor.execute_move(best_move)
+                move_end = time.perf_counter()
+                profiler.mark('move')
+                predicted = settle_predictor.predict(features)
+                observed, settled_screenshot = wait_until_settled(board, move_end, predicted, profiler.sleep)  # the captures and parses of the checks are timed
+                profiler.mark('settle')
+                profiler.end_frame()
+                settle_predictor.update(features, observed)
+                if DEBUG_MODE:
+                    print(f"Settle time predicted {predicted * 1000:.0f} ms, observed {observed * 1000:.0f} ms, {settle_predictor}")
+                continue
+            elif best_move:
+                print(f"Executing move: {best_move}")
+                move_executor.execute_move(best_move)
+                profiler.mark('move')
+            else:
+                print("No valid moves found. Skipping this turn...")
+            profiler.end_frame()
+
+            time.sleep(sleep_time)
+    finally:
+        profiler.close()
+        if debug_viewer:
+            debug_viewer.close()
 
 def start():
     if not run_condition.is_set():
         print("Starting...")
         run_condition.set()
-        main_loop()
+        if len(BOARD_REGIONS) > 1:
+            multi_board_loop(run_condition)
+        else:
+            main_loop()
     else:
         print("Already running")
 
@@ -106,11 +192,16 @@ def exit():
     print("Exiting the program")
     run_condition.clear()
     with suppress(Exception):
+        import cv2
         cv2.destroyAllWindows()
     exit_condition.set()
 
 
 if __name__ == "__main__":
+    from hotkeys import add_hotkey, start_listening, stop_listening
+
+    apply_calibration()
+    validate_config()
     add_hotkey(HOTKEY_START, start)
     add_hotkey(HOTKEY_STOP, stop)
     add_hotkey(HOTKEY_KILL, exit)
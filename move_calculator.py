@@ -6,6 +6,7 @@ The architecture consists of the following components:
 
 1. MoveDetector: Main class responsible for finding the best move.
 2. Move: A class representing a single move (gem swap).
+   MoveSet: All moves of a board in a numpy structured array, used by the heuristics to select the best move without creating Move objects.
 3. MoveEvaluator: A class for evaluating the outcome and score of a move.
 4. BoardSimulator: A class for simulating moves on a copy of the board.
 
@@ -20,10 +21,15 @@ and move evaluation logic.
 """
 
 from copy import deepcopy
+from functools import cached_property
 from typing import List, Optional, Tuple, Iterable
 
-from board import Board, Gem
-from config import GemColor
+import numpy as np
+
+from board import DOWN, LEFT, RIGHT, UP, Board, Gem
+from config import GEM_COLORS, MOVE_GENERATOR, UNKNOWN_GEM, GemColor
+from kernels import match_counts, simulate_swap
+from pattern_db import lookup_match_counts
 
 
 class Move:
@@ -44,35 +50,175 @@ class Move:
         return f"Move({self.gem1}, {self.gem2}, {self.sequences})"
 
 
+def generate_swaps(colors: np.ndarray, run_lengths: np.ndarray, generator: str = MOVE_GENERATOR) -> Tuple[np.ndarray, ...]:
+    """
+    Generate all swaps of two known neighboring gems of the compact board and count their direct matches at once - from the
+    run-length tables (generator 'run_lengths') or by lookups in the pattern database (generator 'pattern_db', see pattern_db.py).
+
+    Returns:
+        (row1, col1, row2, col2, length1, length2) arrays - length1 is the number of gems matched at position 1 (by gem 2 moved there),
+        length2 the same at position 2
+    """
+    rows, cols = colors.shape
+    # each swap once - with the gem below and to the right, in the same order as the first occurrence in a row-by-row walk
+    row1, col1, direction = np.meshgrid(np.arange(rows), np.arange(cols), np.arange(2), indexing='ij')
+    row2, col2 = row1 + (direction == 0), col1 + (direction == 1)
+    valid = (row2 < rows) & (col2 < cols)
+    row1, col1, row2, col2 = row1[valid], col1[valid], row2[valid], col2[valid]
+    color1, color2 = colors[row1, col1], colors[row2, col2]
+    known = (color1 != UNKNOWN_GEM) & (color2 != UNKNOWN_GEM)
+    row1, col1, row2, col2, color1, color2 = row1[known], col1[known], row2[known], col2[known], color1[known], color2[known]
+
+    # gem 2 moves to position 1 and gem 1 moves to position 2
+    if generator == 'pattern_db':
+        length1, length2, exact = lookup_match_counts(colors, row1, col1, row2, col2)
+        if not exact.all():  # matches longer than the pattern window
+            inexact = ~exact
+            length1, length2 = length1.copy(), length2.copy()
+            length1[inexact] = match_counts(colors, run_lengths, row1[inexact], col1[inexact], color2[inexact], row2[inexact], col2[inexact])
+            length2[inexact] = match_counts(colors, run_lengths, row2[inexact], col2[inexact], color1[inexact], row1[inexact], col1[inexact])
+    elif generator == 'run_lengths':
+        length1 = match_counts(colors, run_lengths, row1, col1, color2, row2, col2)
+        length2 = match_counts(colors, run_lengths, row2, col2, color1, row1, col1)
+    else:
+        raise ValueError(f"Unknown move generator '{generator}', use 'run_lengths' or 'pattern_db'.")
+    return row1, col1, row2, col2, length1, length2
+
+
+class MoveSet:
+    dtype = np.dtype([
+        ('move', np.int16),  # id of the move, moves are numbered in the order of generation
+        ('row1', np.int8), ('col1', np.int8), ('row2', np.int8), ('col2', np.int8),  # positions of the swapped gems
+        ('color', np.int8),  # index to GEM_COLORS
+        ('length', np.int8),  # number of gems of this color matched by the move
+        ('longest', np.int8),  # longest sequence of the move (any color)
+        ('cleared', np.int8),  # number of all gems cleared by the move
+        ('cascade', np.int16),  # number of gems cleared by cascades after the direct matches (see compute_cascades)
+    ])
+
+    def __init__(self, board: Board, records: np.ndarray):
+        """
+        All moves of a board in a numpy structured array, one record per move and color - a swap of two gems of different colors
+        has two records (the same as keys of Move.sequences). Heuristics select the best move by sorting the records, and a Move
+        object is created only for the selected one.
+        """
+        self.board = board
+        self.records = records
+
+    @classmethod
+    def from_board(cls, board: Board, generator: str = MOVE_GENERATOR) -> 'MoveSet':
+        """Generate all moves of the board and evaluate them at once, see generate_swaps."""
+        row1, col1, row2, col2, length1, length2 = generate_swaps(board.colors, board.run_lengths, generator)
+        color1, color2 = board.colors[row1, col1], board.colors[row2, col2]
+        # a swap of two gems of the same color does not change the board, it has a single record with the longest existing match
+        same = color1 == color2
+        length2 = np.where(same, np.maximum(length1, length2), length2)
+        length1 = np.where(same, length2, length1)
+
+        records = np.zeros((len(row1), 2), dtype=cls.dtype)
+        records['move'] = np.arange(len(row1))[:, np.newaxis]
+        records['row1'], records['col1'] = row1[:, np.newaxis], col1[:, np.newaxis]
+        records['row2'], records['col2'] = row2[:, np.newaxis], col2[:, np.newaxis]
+        records['color'] = np.stack([color2, color1], axis=1)
+        records['length'] = np.stack([length1, length2], axis=1)
+        records['longest'] = np.maximum(length1, length2)[:, np.newaxis]
+        records['cleared'] = np.where(same, length2, length1 + length2)[:, np.newaxis]
+        keep = np.ones((len(row1), 2), dtype=bool)
+        keep[:, 0] = ~same
+        return cls(board, records[keep])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def compute_cascades(self, candidates: np.ndarray) -> None:
+        """
+        Simulate the moves of the candidate records (with a direct match) until the board is stable and store the number of gems
+        cleared after the direct matches.
+        """
+        cleared_by_color = np.zeros(len(GEM_COLORS), dtype=np.int64)
+        cleared_by_column = np.zeros(self.board.size[1], dtype=np.int64)
+        _, first_indices = np.unique(self.records['move'][candidates], return_index=True)
+        for record in self.records[candidates][first_indices]:
+            if record['longest'] < 3:
+                continue
+            cleared_by_color[:] = 0
+            cleared_by_column[:] = 0
+            simulate_swap(self.board.colors.copy(), record['row1'], record['col1'], record['row2'], record['col2'], cleared_by_color, cleared_by_column)
+            self.records['cascade'][self.records['move'] == record['move']] = cleared_by_column.sum() - record['cleared']
+
+    def to_move(self, index: int) -> Move:
+        """Create a Move from the record at `index` (including other records of the same move)."""
+        record = self.records[index]
+        move = Move(self.board.get_gem(record['row1'], record['col1']), self.board.get_gem(record['row2'], record['col2']))
+        for color, length in self.records[['color', 'length']][self.records['move'] == record['move']]:
+            move.sequences[GEM_COLORS[color]] = int(length)
+        return move
+
+    def to_moves(self) -> List[Move]:
+        _, first_indices = np.unique(self.records['move'], return_index=True)
+        return [self.to_move(index) for index in first_indices]
+
+    def get_color_ranks(self, colors: Iterable[GemColor]) -> np.ndarray:
+        """Rank of the color of each record in the colors order (0 is the first color), len(GEM_COLORS) for colors not in the order."""
+        ranks = np.full(len(GEM_COLORS), len(GEM_COLORS), dtype=np.int8)
+        for rank, color in reversed(list(enumerate(colors))):
+            ranks[GEM_COLORS.index(color)] = rank
+        return ranks[self.records['color']]
+
+
 class BoardSimulator:
     def __init__(self, board: Board) -> None:
         self.orig_board = board
-        self.board = deepcopy(board)
 
-    def simulate_move(self, move: Move) -> None:
-        # Swap gems
-        self.board.set_gem(*move.gem1.position, move.gem2.color)
-        self.board.set_gem(*move.gem2.position, move.gem1.color)
+    @cached_property
+    def board(self) -> Board:
+        """Copy of the original board, which can be modified. Created only when needed, move simulation reads the original board."""
+        return deepcopy(self.orig_board)
 
-        # Get new gems (after the swap)
-        gem1 = self.board.get_gem(*move.gem1.position)
-        gem2 = self.board.get_gem(*move.gem2.position)
+    def simulate_move(self, move: Move) -> None:
+        # Colors of gems after the swap
+        gem1_color = GEM_COLORS.index(move.gem2.color)
+        gem2_color = GEM_COLORS.index(move.gem1.color)
 
         # TODO for simplicity, let's start with counting only the direct matches of the move, later use the repeating calculation below
-        for gem in [gem1, gem2]:
-            matches = self.get_valid_matches(gem)
-            move.sequences[gem.color] = len(matches)
+        move.sequences[move.gem2.color] = self.get_match_count(move.gem1.position, gem1_color, move.gem2.position)
+        move.sequences[move.gem1.color] = self.get_match_count(move.gem2.position, gem2_color, move.gem1.position)
 
-        # TODO calculate matches, clear gems, apply gravity, calculate new matches, repeat...
-        # Check for matches and apply cascading effects
-        # while True:
-        #     matches = BoardSimulator.find_all_matches(simulated_board)
-        #     if not matches:
-        #         break
+        # cascades (clear matches, apply gravity, repeat) are simulated on the compact board by kernels.simulate_swap,
+        # see MoveSet.compute_cascades
 
-        #     score += len(matches)
-        #     BoardSimulator.remove_matches(simulated_board, matches)
-        #     BoardSimulator.apply_gravity(simulated_board)
+    def get_match_count(self, position: Tuple[int, int], color: int, swapped_position: Tuple[int, int]) -> int:
+        """
+        Get the number of gems matched by a gem of `color` (index to GEM_COLORS) moved to `position` by a swap with `swapped_position`.
+        It is the same as len(get_valid_matches(gem)) on the board after the swap, but it is read from the run-length tables of
+        the original board in O(1), without modifying the board or walking it.
+        """
+        board = self.orig_board
+        colors, run_lengths = board.colors, board.run_lengths
+        row, col = position
+        if colors[row, col] == color:
+            # swap of two gems of the same color does not change the board
+            horizontal = run_lengths[LEFT, row, col] + run_lengths[RIGHT, row, col] - 1
+            vertical = run_lengths[UP, row, col] + run_lengths[DOWN, row, col] - 1
+        else:
+            # the run continues from each neighbor of the same color, except the swapped one (it has the other color after the swap),
+            # runs behind the neighbors are not affected by the swap
+            extensions = [0, 0, 0, 0]
+            for direction, (neighbor_row, neighbor_col) in ((LEFT, (row, col - 1)), (RIGHT, (row, col + 1)), (UP, (row - 1, col)), (DOWN, (row + 1, col))):
+                if (neighbor_row, neighbor_col) != swapped_position and board.is_valid_position(neighbor_row, neighbor_col) \
+                        and colors[neighbor_row, neighbor_col] == color:
+                    extensions[direction] = run_lengths[direction, neighbor_row, neighbor_col]
+            horizontal = 1 + extensions[LEFT] + extensions[RIGHT]
+            vertical = 1 + extensions[UP] + extensions[DOWN]
+
+        if horizontal >= 3 and vertical >= 3:
+            return int(horizontal + vertical - 1)
+        elif horizontal >= 3:
+            return int(horizontal)
+        elif vertical >= 3:
+            return int(vertical)
+        else:
+            return 0
 
     def get_valid_matches(self, gem: Gem) -> List[Gem]:
         """Get matching gems connected to this gem, including this gem. Only if there is a valid match of 3 or more gems, otherwise empty list."""
@@ -148,92 +294,58 @@ class MoveCalculator:
         self.move_evaluator = MoveEvaluator()
 
     @staticmethod
-    def _get_longest_from(moves: List[Move]) -> Optional[Move]:
-        longest = None
-        if len(moves) >= 1:
-            longest = moves[0]
-        for move in moves:
-            if move.longest_sequence > longest.longest_sequence:
-                longest = move
+    def _get_longest_from(move_set: MoveSet, candidates: np.ndarray, *keys: np.ndarray) -> Optional[Move]:
+        """
+        Select the longest move among the candidate records. Ties are resolved by the additional keys (lower is better, the first key
+        is the most significant) and then by the order of generation.
+        """
+        if not candidates.any():
+            return None
+        records = move_set.records
+        order = np.lexsort((records['move'], *reversed(keys), -records['longest'].astype(np.int16), ~candidates))
+        return move_set.to_move(order[0])
 
-        return longest
+    def calculate_move_set(self, board: Board) -> MoveSet:
+        return MoveSet.from_board(board)
 
     def calculate_all_valid_moves(self, board: Board) -> List[Move]:
-        moves = []
-        for row in range(board.size[0]):
-            for col in range(board.size[1]):
-                current_gem = board.get_gem(row, col)
-                if current_gem is None:
-                    continue
-
-                adjacent_positions = board.get_adjacent_positions(row, col)
-                for adj_row, adj_col in adjacent_positions:
-                    adjacent_gem: Gem | None = board.get_gem(adj_row, adj_col)
-                    # FIXME use unknown gem instead of None, so it can be calculate dproperly in the simulator (with position etc.)
-                    if adjacent_gem is None:
-                        continue
-                    move = Move(current_gem, adjacent_gem)
-                    self.move_evaluator.evaluate_move(board, move)
-                    moves.append(move)
-
-        return moves
-
-    def get_all_moves_grouped_by_color(self, board: Board) -> dict[GemColor, list[Move]]:
-        all_moves = self.calculate_all_valid_moves(board)
-        moves = {}
-        for move in all_moves:
-            for color in move.sequences.keys():
-                try:
-                    moves[color].append(move)
-                except KeyError:
-                    moves[color] = [move]
-        return moves
+        return self.calculate_move_set(board).to_moves()
 
     def find_longest_sequence_move(self, board: Board) -> Optional[Move]:
-        moves = self.calculate_all_valid_moves(board)
-        return self._get_longest_from(moves)
+        move_set = self.calculate_move_set(board)
+        return self._get_longest_from(move_set, np.ones(len(move_set), dtype=bool))
 
     def get_move_by_color_ordering(self, board: Board, colors: Iterable[GemColor] = tuple(c for c in GemColor)) -> Optional[Move]:
         """
         Get moves of color 1, if not available, then of color 2, etc. The selected move is the longest available in the first available color.
         Note: There can be longer moves available in other colors, but we ignore them. We want to first deplete one color, then another, etc.
         """
-        all_moves = self.get_all_moves_grouped_by_color(board)
-        moves = []
-        for color in colors:
-            try:
-                moves = all_moves[color]
-                break
-            except KeyError:
-                continue
-
-        return self._get_longest_from(moves)
+        move_set = self.calculate_move_set(board)
+        ranks = move_set.get_color_ranks(colors)
+        first_rank = ranks.min(initial=len(GEM_COLORS))  # the first color with any move
+        return self._get_longest_from(move_set, (ranks == first_rank) & (first_rank < len(GEM_COLORS)))
 
     def find_longest_with_color_order(self, board: Board, colors: Iterable[GemColor] = tuple(c for c in GemColor)) -> Optional[Move]:
         """
         Find the longest move. If there are multiple longest moves, return the move determined by the colors order.
         E.g. longest moves are [blue=5, green=5, red=4] and color order is [red, green, blue], then return green=5.
         """
-        all_moves = self.get_all_moves_grouped_by_color(board)
-        moves = {}  # key is length, value is list of moves ordered by color (if any available for the given length)
-        for color in colors:
-            try:
-                current_color_moves = all_moves[color]
-                if not current_color_moves:
-                    continue  # no moves for this color
-            except KeyError:
-                continue  # no moves for this color
-
-            longest = self._get_longest_from(current_color_moves)
-            try:
-                moves[longest.longest_sequence].append(longest)
-            except KeyError:
-                moves[longest.longest_sequence] = [longest]
-
-        if not moves:
-            return None
-        return moves[max(moves.keys())][0]
-
+        move_set = self.calculate_move_set(board)
+        ranks = move_set.get_color_ranks(colors)
+        return self._get_longest_from(move_set, ranks < len(GEM_COLORS), ranks)
 
-    def find_best_move(self, board: Board) -> Optional[Move]:
-        return self.find_longest_with_color_order(board)  # currently the best available heuristic
+    def find_best_move(self, board: Board, colors: Iterable[GemColor] = tuple(c for c in GemColor)) -> Optional[Move]:
+        """
+        Find the longest move, ties are resolved by the colors order (see find_longest_with_color_order) and then by the number
+        of gems cleared by cascades. Cascades are simulated only for the tied moves.
+        """
+        move_set = self.calculate_move_set(board)
+        ranks = move_set.get_color_ranks(colors)
+        candidates = ranks < len(GEM_COLORS)
+        if not candidates.any():
+            return None
+        longest = move_set.records['longest']
+        candidates &= longest == longest[candidates].max()
+        candidates &= ranks == ranks[candidates].min()
+        move_set.compute_cascades(candidates)
+        return self._get_longest_from(move_set, candidates, -move_set.records['cascade'])
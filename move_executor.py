@@ -1,18 +1,22 @@
-from typing import Tuple
+from typing import Optional, Tuple
 
-from config import BOARD_REGION, GEM_SIZE
-from mouse import Mouse
+import config
+from config import BOARD_SIZE
 from move_calculator import Move
 
 
 class MoveExecutor:
-    def __init__(self):
-        self.board_left: int = BOARD_REGION[0]
-        self.board_top: int = BOARD_REGION[1]
-        self.gem_width: int = GEM_SIZE[0]
-        self.gem_height: int = GEM_SIZE[1]
+    def __init__(self, board_region: Optional[Tuple[int, int, int, int]] = None):
+        """Play moves on the board in `board_region` (left, top, width, height) of the screen, BOARD_REGION by default."""
+        board_region = board_region or config.BOARD_REGION
+        self.board_left: int = board_region[0]
+        self.board_top: int = board_region[1]
+        self.gem_width: int = board_region[2] // BOARD_SIZE[0]
+        self.gem_height: int = board_region[3] // BOARD_SIZE[1]
 
     def execute_move(self, move: Move) -> None:
+        from mouse import Mouse  # imported on first use, it initializes pyautogui and win32 libraries
+
         # Calculate the screen coordinates for both gems
         x1, y1 = self._get_gem_center(move.gem1.position)
         x2, y2 = self._get_gem_center(move.gem2.position)
@@ -0,0 +1,189 @@
+"""
+Multi-board mode - plays several game clients side by side (BOARD_REGIONS) from one process, used by main.py if more than one
+board region is configured.
+
+All boards are captured by one grab of the rectangle enclosing them and the regions are sliced out of it. Parsing and the move
+search of each board run in a shared pool of MULTI_BOARD_WORKERS processes (see board_worker.py). There is only one mouse, so all
+moves are played by a single input thread from a queue - while one board animates after its move, the moves of the other boards
+are played.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import suppress
+from queue import Empty, Queue
+from threading import Event, Thread
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from board_worker import PlanResult, SharedFrame, init_worker, plan_board
+from config import (BOARD_REGIONS, DEBUG_MODE, MAX_RECAPTURE_COUNT, MAX_REPETITION_COUNT, MULTI_BOARD_WORKERS, RECAPTURE_INTERVAL,
+                    SCREENSHOT_INTERVAL, SETTLE_CHECK_INTERVAL, SETTLE_MARGIN, SETTLE_PREDICTION, SETTLE_TIMEOUT)
+from move_executor import MoveExecutor
+from settle_predictor import SettlePredictor
+
+Region = Tuple[int, int, int, int]  # left, top, width, height
+
+
+def get_union_region(regions: List[Region]) -> Region:
+    """Get the smallest region enclosing all regions."""
+    left = min(region[0] for region in regions)
+    top = min(region[1] for region in regions)
+    right = max(region[0] + region[2] for region in regions)
+    bottom = max(region[1] + region[3] for region in regions)
+    return left, top, right - left, bottom - top
+
+
+def capture_regions(union: Region, regions: List[Region]) -> List[np.ndarray]:
+    """Capture the union region once and return screenshots of the regions (views of the capture, RGB order), see main.capture_board_screenshot."""
+    import mss  # imported on first use, main.py is imported again by the worker processes on platforms which spawn them
+
+    with mss.mss() as sct:
+        screenshot = sct.grab({'left': union[0], 'top': union[1], 'width': union[2], 'height': union[3]})
+        rgb_screenshot = np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)[..., 2::-1]
+    return [rgb_screenshot[top - union[1]:top - union[1] + height, left - union[0]:left - union[0] + width]
+            for left, top, width, height in regions]
+
+
+class BoardState:
+    def __init__(self, index: int, region: Region):
+        """Scheduling state of one board - when it is expected to be stable again and what is in progress."""
+        self.index = index
+        self.region = region
+        self.frame = SharedFrame((region[3], region[2], 3))  # the latest capture, read by the worker processes
+        self.move_executor = MoveExecutor(region)
+        self.settle_predictor = SettlePredictor()
+        self.ready_at = 0.0  # [perf_counter seconds] the board is captured again from this time on
+        self.pending: Optional[Future] = None  # parsing and search in a worker process
+        self.capture_time = 0.0  # [perf_counter seconds] capture of the pending screenshot
+        self.in_input_queue = False  # the move is waiting for the input thread or being played
+        self.move_end: Optional[float] = None  # end of the last move, until the board is stable
+        self.features: Optional[np.ndarray] = None  # settle time features of the last move
+        self.last_colors: Optional[np.ndarray] = None  # the board of the previous capture
+        self.last_capture_time = 0.0
+        self.previous_colors: Optional[np.ndarray] = None  # the board of the previous played (or skipped) turn
+        self.repetition_count = 0
+        self.recapture_count = 0
+
+    def is_ready(self, now: float) -> bool:
+        return self.pending is None and not self.in_input_queue and self.ready_at <= now
+
+    def is_settling(self, colors: np.ndarray) -> bool:
+        """
+        Check whether the board is still animating after the last move - it is stable once two consecutive captures are the same
+        (unknown cells included), see main.wait_until_settled. Learns the settle time when the board becomes stable.
+        """
+        if self.move_end is None:
+            return False
+        stable = self.last_capture_time > self.move_end and np.array_equal(colors, self.last_colors)
+        if not stable and self.capture_time - self.move_end > SETTLE_TIMEOUT / 1000:
+            stable = True  # stop waiting, e.g. an animated background in the board region never gives two identical captures
+        if not stable:
+            return True
+        self.settle_predictor.update(self.features, self.last_capture_time - self.move_end)
+        self.move_end = None
+        return False
+
+    def close(self) -> None:
+        self.frame.close()
+
+
+def run_input_queue(input_queue: Queue) -> None:
+    """Play the queued moves one by one (single mouse), a None item stops the thread."""
+    while (item := input_queue.get()) is not None:
+        board_state, move = item
+        print(f"Board {board_state.index}: executing move {move}")
+        board_state.move_executor.execute_move(move)
+        board_state.move_end = time.perf_counter()
+        if SETTLE_PREDICTION:
+            predicted = board_state.settle_predictor.predict(board_state.features)
+            board_state.ready_at = board_state.move_end + max(predicted - SETTLE_MARGIN / 1000, 0)
+        else:
+            board_state.ready_at = board_state.move_end + SCREENSHOT_INTERVAL / 1000
+        board_state.in_input_queue = False  # after ready_at is set, the main thread must not capture the board before that
+
+
+def handle_result(board_state: BoardState, result: PlanResult, input_queue: Queue) -> None:
+    """Queue the move of the board or schedule its next capture."""
+    now = time.perf_counter()
+    settling = board_state.is_settling(result.colors)
+    # ambiguous cells (e.g. gems still falling) are captured again, unless the capture is the same as the previous one
+    recapture = result.ambiguous and board_state.recapture_count < MAX_RECAPTURE_COUNT and not np.array_equal(result.colors, board_state.last_colors)
+    board_state.last_colors, board_state.last_capture_time = result.colors, board_state.capture_time
+    if settling:
+        board_state.ready_at = now + SETTLE_CHECK_INTERVAL / 1000
+        return
+    if recapture:
+        board_state.recapture_count += 1
+        board_state.ready_at = now + RECAPTURE_INTERVAL / 1000
+        return
+    board_state.recapture_count = 0
+
+    # check for repetitions to avoid being stuck in an endless loop if the best move is invalid and does nothing (can't be played)
+    if board_state.previous_colors is not None and np.array_equal(result.colors, board_state.previous_colors):
+        board_state.repetition_count += 1
+    else:
+        board_state.repetition_count = 0
+    board_state.previous_colors = result.colors
+
+    if result.move:
+        board_state.features = result.features
+        board_state.in_input_queue = True
+        input_queue.put((board_state, result.move))
+    else:
+        print(f"Board {board_state.index}: no valid moves found. Skipping this turn...")
+        board_state.ready_at = now + SCREENSHOT_INTERVAL / 1000
+
+
+def multi_board_loop(run_condition: Event, regions: List[Region] = BOARD_REGIONS) -> None:
+    """Play all boards until `run_condition` is cleared."""
+    board_states = [BoardState(index, region) for index, region in enumerate(regions)]
+    union = get_union_region(regions)
+    input_queue = Queue()
+    input_thread = Thread(target=run_input_queue, args=(input_queue,), daemon=True)
+    input_thread.start()
+
+    print(f"Starting multi-board loop with {len(board_states)} boards...")
+    with ProcessPoolExecutor(MULTI_BOARD_WORKERS, initializer=init_worker) as pool:
+        try:
+            while run_condition.is_set():
+                now = time.perf_counter()
+                ready = [board_state for board_state in board_states if board_state.is_ready(now)]
+                if ready:
+                    screenshots = capture_regions(union, [board_state.region for board_state in ready])
+                    for board_state, screenshot in zip(ready, screenshots):
+                        board_state.frame.array[:] = screenshot
+                        board_state.capture_time = now
+                        random_move = board_state.repetition_count >= MAX_REPETITION_COUNT
+                        if random_move:
+                            print(f"Board {board_state.index}: repetition detected. Trying to find a different move...")
+                        board_state.pending = pool.submit(plan_board, board_state.frame.name, board_state.frame.shape, random_move)
+
+                # wait for any result, or until the next board is expected to be stable
+                pending = [board_state.pending for board_state in board_states if board_state.pending]
+                waiting = [board_state.ready_at for board_state in board_states if board_state.pending is None and not board_state.in_input_queue]
+                timeout = max(min(waiting, default=now + SCREENSHOT_INTERVAL / 1000) - time.perf_counter(), 0.001)
+                if any(board_state.in_input_queue for board_state in board_states):
+                    timeout = min(timeout, SETTLE_CHECK_INTERVAL / 1000)  # the input thread can finish a move at any time
+                if pending:
+                    wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+
+                for board_state in board_states:
+                    if board_state.pending and board_state.pending.done():
+                        result = board_state.pending.result()
+                        board_state.pending = None
+                        handle_result(board_state, result, input_queue)
+                        if DEBUG_MODE and result.move:
+                            print(f"Board {board_state.index}: {board_state.settle_predictor}")
+        finally:
+            # moves still waiting in the queue are dropped, only the one being played is finished
+            with suppress(Empty):
+                while True:
+                    input_queue.get_nowait()
+            input_queue.put(None)
+            input_thread.join()
+            pool.shutdown(cancel_futures=True)
+            for board_state in board_states:
+                board_state.close()
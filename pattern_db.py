@@ -0,0 +1,86 @@
+"""
+Pattern database of direct matches of a swap.
+
+Direct matches of a swap depend only on a small window around the swapped gems, and only on which gems in the window have the same
+color as the swapped ones - not on the colors themselves. So each window is canonicalized to a pattern of 13 bits (which neighbors
+have the color of gem 1, which have the color of gem 2 and whether both gems have the same color), and the match counts of all
+8192 patterns are precomputed offline by tools/build_pattern_db.py. The table is memory-mapped, so it is loaded lazily and shared
+by all processes using it (via the OS page cache).
+
+Layout of the window of a horizontal swap of p1 and p2 (p2 is to the right, vertical swaps use the transposed board):
+         X3 Y9
+         X2 Y8
+   X1 X0 p1 p2 Y6 Y7
+         X4 Y10
+         X5 Y11
+Bits X are set if the neighbor has the color moving to p1 (the color of p2 before the swap), bits Y for the color moving to p2.
+The left-right mirror of a window swaps bits X and Y, the up-down mirror swaps bits above and below - the builder computes only
+one pattern of each group of mirrored patterns.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+from config import PATTERN_DB_FILE, UNKNOWN_GEM
+
+X_OFFSETS = ((0, -1), (0, -2), (-1, 0), (-2, 0), (1, 0), (2, 0))  # (row, col) offsets from p1 of bits 0-5
+Y_OFFSETS = ((0, 2), (0, 3), (-1, 1), (-2, 1), (1, 1), (2, 1))  # (row, col) offsets from p1 of bits 6-11
+SAME_COLOR_BIT = 12
+PATTERN_COUNT = 1 << 13
+WINDOW_PADDING = 3  # the farthest neighbor in the window
+
+# bit pairs (inner, outer) - if both are set, the match can continue outside the window and the pattern is not exact
+EDGE_BITS = ((0, 1), (2, 3), (4, 5), (6, 7), (8, 9), (10, 11))
+LEFT_RIGHT_MIRROR = (6, 7, 8, 9, 10, 11, 0, 1, 2, 3, 4, 5, 12)  # new position of each bit
+UP_DOWN_MIRROR = (0, 1, 4, 5, 2, 3, 6, 7, 10, 11, 8, 9, 12)
+
+# columns of the table
+COUNT1, COUNT2, EXACT = range(3)
+
+
+def mirror_pattern(pattern: int, mirror: Tuple[int, ...]) -> int:
+    return sum(1 << mirror[bit] for bit in range(SAME_COLOR_BIT + 1) if pattern >> bit & 1)
+
+
+def get_pattern_keys(colors: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Get patterns of horizontal swaps of (rows, cols) with (rows, cols + 1) on the compact board (transpose the board for vertical swaps)."""
+    padded = np.pad(colors, WINDOW_PADDING, constant_values=UNKNOWN_GEM)
+    rows, cols = rows + WINDOW_PADDING, cols + WINDOW_PADDING
+    color1, color2 = padded[rows, cols + 1], padded[rows, cols]  # colors moving to p1 and p2
+    keys = (color1 == color2).astype(np.int16) << SAME_COLOR_BIT
+    for bit, (row_offset, col_offset) in enumerate(X_OFFSETS):
+        keys |= (padded[rows + row_offset, cols + col_offset] == color1).astype(np.int16) << bit
+    for bit, (row_offset, col_offset) in enumerate(Y_OFFSETS, start=len(X_OFFSETS)):
+        keys |= (padded[rows + row_offset, cols + col_offset] == color2).astype(np.int16) << bit
+    return keys
+
+
+@lru_cache(maxsize=1)
+def load_pattern_db(path: Path = PATTERN_DB_FILE) -> np.ndarray:
+    """Memory-map the pattern table (PATTERN_COUNT, 3) - match counts at p1 and p2 and whether the counts are exact."""
+    if not Path(path).is_file():
+        raise FileNotFoundError(f"Pattern database {path} not found, build it by: python tools/build_pattern_db.py")
+    table = np.load(path, mmap_mode='r')
+    if table.shape != (PATTERN_COUNT, 3):
+        raise ValueError(f"Pattern database {path} has unexpected shape {table.shape}, build it again by: python tools/build_pattern_db.py")
+    return table
+
+
+def lookup_match_counts(colors: np.ndarray, row1: np.ndarray, col1: np.ndarray, row2: np.ndarray, col2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Look up direct match counts of swaps (gem 2 moves to position 1 and gem 1 moves to position 2), gem 2 must be to the right
+    of or below gem 1.
+
+    Returns:
+        (count at position 1, count at position 2, whether the counts are exact) - counts of matches reaching outside the window
+        are not exact and must be computed from the board.
+    """
+    table = load_pattern_db()
+    vertical = row2 > row1
+    keys = np.empty(len(row1), dtype=np.int16)
+    keys[~vertical] = get_pattern_keys(colors, row1[~vertical], col1[~vertical])
+    keys[vertical] = get_pattern_keys(colors.T, col1[vertical], row1[vertical])
+    outcomes = table[keys]
+    return outcomes[:, COUNT1], outcomes[:, COUNT2], outcomes[:, EXACT].astype(bool)
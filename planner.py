@@ -0,0 +1,91 @@
+"""
+Multi-move planner - a bounded beam search over sequences of moves on the simulated (compact) board. Gems refilled after a match
+are unknown, so they never match in the simulation. The plan is reused across frames while the observed board matches the predicted
+one, the search runs again only when they diverge (e.g. refilled gems created an unexpected match).
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from board import LEFT, RIGHT, UP, DOWN, Board, compute_run_lengths
+from config import GEM_COLORS, PLANNER_BEAM_WIDTH, PLANNER_COLOR_WEIGHTS, PLANNER_DEPTH, PLANNER_OTHER_COLOR_WEIGHT, UNKNOWN_GEM, GemColor
+from kernels import simulate_swap
+from move_calculator import Move, MoveEvaluator, generate_swaps
+
+Swap = Tuple[int, int, int, int]  # row1, col1, row2, col2
+
+
+class PlanNode:
+    def __init__(self, colors: np.ndarray, score: float, swaps: List[Swap], boards: List[np.ndarray]):
+        """A sequence of swaps, the compact board after each of them and the score of the sequence."""
+        self.colors = colors
+        self.score = score
+        self.swaps = swaps
+        self.boards = boards
+
+
+class BeamPlanner:
+    def __init__(self, depth: int = PLANNER_DEPTH, beam_width: int = PLANNER_BEAM_WIDTH,
+                 color_weights: dict[GemColor, float] = PLANNER_COLOR_WEIGHTS, other_color_weight: float = PLANNER_OTHER_COLOR_WEIGHT):
+        """
+        Plan `depth` moves ahead, keeping only the `beam_width` best sequences after each move. The objective is the weighted sum
+        of cleared gems (including cascades) - `color_weights` of the target colors and `other_color_weight` for the rest.
+        """
+        self.depth = depth
+        self.beam_width = beam_width
+        self.color_weights = np.full(len(GEM_COLORS), other_color_weight)
+        for color, weight in color_weights.items():
+            self.color_weights[GEM_COLORS.index(color)] = weight
+        self.plan: Optional[PlanNode] = None
+        self.next_step = 0  # index of the next move of the plan
+
+    def plan_moves(self, colors: np.ndarray) -> Optional[PlanNode]:
+        """Find the best sequence of up to `depth` moves from the compact board, or None if there is no valid move."""
+        rows, cols = colors.shape
+        run_lengths = np.zeros((4, rows, cols), dtype=np.int8)
+        cleared_by_color = np.zeros(len(GEM_COLORS), dtype=np.int64)
+        cleared_by_column = np.zeros(cols, dtype=np.int64)
+        beam = [PlanNode(colors, 0.0, [], [])]
+        best = None
+        for _ in range(self.depth):
+            children = []
+            for node in beam:
+                compute_run_lengths(node.colors, run_lengths[LEFT], run_lengths[RIGHT])
+                compute_run_lengths(node.colors.T, run_lengths[UP].T, run_lengths[DOWN].T)
+                row1, col1, row2, col2, length1, length2 = generate_swaps(node.colors, run_lengths)
+                for swap in zip(*(array[np.maximum(length1, length2) >= 3] for array in (row1, col1, row2, col2))):
+                    swap = tuple(int(value) for value in swap)
+                    child_colors = node.colors.copy()
+                    cleared_by_color[:] = 0
+                    cleared_by_column[:] = 0  # not used by the objective, reset so the counts stay per move
+                    simulate_swap(child_colors, *swap, cleared_by_color, cleared_by_column)
+                    score = node.score + float(self.color_weights @ cleared_by_color)
+                    children.append(PlanNode(child_colors, score, node.swaps + [swap], node.boards + [child_colors]))
+            if not children:
+                break
+            children.sort(key=lambda child: child.score, reverse=True)  # stable, so ties keep the order of generation
+            beam = children[:self.beam_width]
+            if best is None or beam[0].score > best.score:
+                best = beam[0]
+        return best
+
+    def is_on_plan(self, colors: np.ndarray) -> bool:
+        """Check that the observed board matches the predicted board after the last played move (unknown predicted cells match anything)."""
+        if self.plan is None or not 0 < self.next_step < len(self.plan.swaps):
+            return False
+        predicted = self.plan.boards[self.next_step - 1]
+        known = predicted != UNKNOWN_GEM
+        return bool(np.array_equal(colors[known], predicted[known]))
+
+    def get_move(self, board: Board) -> Optional[Move]:
+        """Get the next move of the plan, plan again if the board diverged from the prediction (or the plan is finished)."""
+        if not self.is_on_plan(board.colors):
+            self.plan = self.plan_moves(board.colors)
+            self.next_step = 0
+            if self.plan is None:
+                return None
+        row1, col1, row2, col2 = self.plan.swaps[self.next_step]
+        self.next_step += 1
+        move = Move(board.get_gem(row1, col1), board.get_gem(row2, col2))
+        MoveEvaluator.evaluate_move(board, move)
+        return move
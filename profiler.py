@@ -0,0 +1,141 @@
+"""
+Slow-frame profiler - measures the wall time of each frame of the main loop (capture, parse, search, move) by phases, and if
+a frame takes longer than SLOW_FRAME_THRESHOLD, dumps what happened in it to PROFILES_DIR/<timestamp>/:
+    phases.txt - time of each phase of the frame
+    stacks.txt - sampled stacks of the main loop thread after the threshold was exceeded (collapsed format: "frame;frame;... count",
+                 can be rendered by flamegraph tools)
+    screenshot.png, board.npy, board.txt - the input screenshot and the parsed board, replay them by: python tools/replay_frame.py <dir>
+Pauses inside a frame (e.g. waiting for the board to settle after the move) are slept by SlowFrameProfiler.sleep and don't count.
+
+A watchdog thread sleeps until the threshold of the current frame and starts sampling only if the frame is still running, so frames
+that are not slow cost just a few lock operations.
+"""
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+import sys
+from threading import Condition, Thread, get_ident
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from board import Board
+from config import PROFILER_SAMPLE_INTERVAL, PROFILES_DIR, SLOW_FRAME_THRESHOLD
+
+
+def format_stack(frame) -> str:
+    """Collapse the stack of the frame to one line, the outermost call first."""
+    calls = []
+    while frame is not None:
+        calls.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(calls))
+
+
+class SlowFrameProfiler:
+    def __init__(self, threshold: Optional[float] = SLOW_FRAME_THRESHOLD, sample_interval: float = PROFILER_SAMPLE_INTERVAL, output_dir: Path = PROFILES_DIR):
+        """Profile the frames of the calling thread, times are in milliseconds. If the threshold is None, only the phases are measured."""
+        self.enabled = threshold is not None
+        self.threshold = threshold / 1000 if self.enabled else float('inf')
+        self.sample_interval = sample_interval / 1000
+        self.output_dir = Path(output_dir)
+        self.thread_id = get_ident()
+        self.phases: List[Tuple[str, float]] = []  # (name, seconds) of the current frame
+        self._condition = Condition()
+        self._frame_id = 0
+        self._frame_running = False
+        self._paused = False  # sleeping in the frame, see sleep
+        self._closed = False
+        self._frame_start = 0.0
+        self._last_mark = 0.0
+        self._samples: Counter = Counter()  # collapsed stack -> number of samples
+        self._input: Optional[Tuple[np.ndarray, np.ndarray, str]] = None  # screenshot, board colors and board text of the frame, see set_input
+        if self.enabled:
+            Thread(target=self._watch, daemon=True).start()
+
+    def start_frame(self) -> None:
+        with self._condition:
+            self._frame_id += 1
+            self._frame_running = True
+            self._frame_start = self._last_mark = time.perf_counter()
+            self._samples = Counter()
+            self.phases = []
+            self._input = None
+            self._condition.notify()
+
+    def set_input(self, screenshot: np.ndarray, board: Board) -> None:
+        """Keep the screenshot of the frame and a copy of the board parsed from it (the board is parsed again later in the frame, e.g. by the settle checks)."""
+        self._input = (screenshot, board.colors.copy(), str(board))
+
+    def mark(self, phase: str) -> None:
+        """End a phase of the frame (it started by the previous mark or the start of the frame)."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last_mark))
+        self._last_mark = now
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep inside the frame, the time is excluded from the frame and its phases."""
+        with self._condition:
+            self._paused = True
+            self._condition.notify()
+        start = time.perf_counter()
+        time.sleep(seconds)
+        with self._condition:
+            slept = time.perf_counter() - start
+            self._frame_start += slept
+            self._last_mark += slept
+            self._paused = False
+            self._condition.notify()
+
+    def end_frame(self) -> Optional[Path]:
+        """End the frame (before any intentional waiting outside of sleep), dump it if it was slow. Returns the directory of the dump, if any."""
+        with self._condition:
+            if not self._frame_running:
+                return None
+            self._frame_running = False
+            self._condition.notify()
+            elapsed = time.perf_counter() - self._frame_start
+            samples = self._samples
+        if elapsed < self.threshold or self._input is None:
+            return None
+        directory = self.dump(*self._input, elapsed, samples)
+        print(f"Slow frame ({elapsed * 1000:.0f} ms), profile saved to {directory}")
+        return directory
+
+    def dump(self, screenshot: np.ndarray, colors: np.ndarray, board_text: str, elapsed: float, samples: Counter) -> Path:
+        import cv2  # imported on first use, so the main module imports no GUI libraries (see main.py)
+
+        directory = self.output_dir / datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        directory.mkdir(parents=True)
+        phases = [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases]
+        (directory / 'phases.txt').write_text('\n'.join([f"frame: {elapsed * 1000:.1f} ms", *phases]) + '\n')
+        (directory / 'stacks.txt').write_text(''.join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+        cv2.imwrite(str(directory / 'screenshot.png'), cv2.cvtColor(np.ascontiguousarray(screenshot), cv2.COLOR_RGB2BGR))
+        np.save(directory / 'board.npy', colors)
+        (directory / 'board.txt').write_text(board_text)
+        return directory
+
+    def close(self) -> None:
+        """Stop the watchdog thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _watch(self) -> None:
+        """
+        Watchdog - wait until the running frame exceeds the threshold, then sample the stack of the profiled thread until it ends.
+        A sleep of the frame interrupts the waiting, which starts again with the threshold moved by the slept time.
+        """
+        with self._condition:
+            while not self._closed:
+                self._condition.wait_for(lambda: self._closed or self._frame_running and not self._paused)
+                frame_id, frame_start = self._frame_id, self._frame_start
+                interrupted = lambda: (self._closed or self._frame_id != frame_id or not self._frame_running or self._paused
+                                       or self._frame_start != frame_start)
+                if self._condition.wait_for(interrupted, timeout=max(frame_start + self.threshold - time.perf_counter(), 0)):
+                    continue  # not slow (yet)
+                while not self._condition.wait_for(interrupted, timeout=self.sample_interval):
+                    frame = sys._current_frames().get(self.thread_id)
+                    if frame is not None:
+                        self._samples[format_stack(frame)] += 1
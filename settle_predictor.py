@@ -0,0 +1,41 @@
+import numpy as np
+
+from board import Board
+from config import GEM_COLORS, SCREENSHOT_INTERVAL, SETTLE_LEARNING_RATE
+from kernels import simulate_swap
+from move_calculator import Move
+
+
+class SettlePredictor:
+    def __init__(self, learning_rate: float = SETTLE_LEARNING_RATE):
+        """
+        Predict how long the board animates after a move (gems clearing, falling and refilling) from the simulated outcome
+        of the move. The prediction is linear in features of the outcome and its weights are learned online from the observed
+        times until the board was stable.
+        """
+        self.learning_rate = learning_rate
+        # [seconds] base time, time per cascade step, time per gem falling in the busiest column (initial guesses, then learned)
+        self.weights = np.array([SCREENSHOT_INTERVAL / 1000, 0.3, 0.03])
+
+    @staticmethod
+    def get_features(board: Board, move: Move) -> np.ndarray:
+        """Simulate the move on the compact board and return its features: (1, cascade depth, most gems cleared in one column)."""
+        cleared_by_color = np.zeros(len(GEM_COLORS), dtype=np.int64)
+        cleared_by_column = np.zeros(board.size[1], dtype=np.int64)
+        depth = simulate_swap(board.colors.copy(), *move.gem1.position, *move.gem2.position, cleared_by_color, cleared_by_column)
+        return np.array([1.0, depth, cleared_by_column.max()])
+
+    def predict(self, features: np.ndarray) -> float:
+        """Return the predicted time [seconds] from the end of the move until the board is stable."""
+        return max(float(self.weights @ features), 0.0)
+
+    def update(self, features: np.ndarray, observed: float) -> None:
+        """Learn from the observed time [seconds] until the board was stable (normalized least mean squares step)."""
+        error = observed - self.predict(features)
+        self.weights += self.learning_rate * error * features / (features @ features)
+        self.weights = np.maximum(self.weights, 0)
+
+    def __str__(self) -> str:
+        base, per_step, per_gem = self.weights
+        return f"SettlePredictor(base={base * 1000:.0f} ms, per cascade step={per_step * 1000:.0f} ms, per fallen gem={per_gem * 1000:.0f} ms)"
+
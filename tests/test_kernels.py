@@ -0,0 +1,50 @@
+"""Property check of the kernels (see kernels.py) - all implementations must give identical results on random boards."""
+import numpy as np
+import pytest
+
+from board import DOWN, LEFT, RIGHT, UP, compute_run_lengths
+from config import GEM_COLORS, UNKNOWN_GEM
+from kernels import match_counts_loops, match_counts_numpy, numba, resolve_cascade_loops, resolve_cascade_numpy
+
+IMPLEMENTATIONS = {'loops': (match_counts_loops, resolve_cascade_loops)}
+if numba is not None:
+    IMPLEMENTATIONS['numba'] = (numba.njit(match_counts_loops), numba.njit(resolve_cascade_loops))
+
+
+def random_boards(count: int = 500, seed: int = 0):
+    """Yield random compact boards of random sizes with 2-6 colors, some of them with unknown cells."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        size = tuple(rng.integers(3, 10, size=2))
+        colors = rng.integers(0, rng.integers(2, 7), size=size).astype(np.int8)
+        colors[rng.random(size) < rng.choice([0, 0.1])] = UNKNOWN_GEM
+        yield rng, colors
+
+
+@pytest.mark.parametrize('name', IMPLEMENTATIONS)
+def test_match_counts(name):
+    match_counts = IMPLEMENTATIONS[name][0]
+    for rng, colors in random_boards():
+        run_lengths = np.zeros((4, *colors.shape), dtype=np.int8)
+        compute_run_lengths(colors, run_lengths[LEFT], run_lengths[RIGHT])
+        compute_run_lengths(colors.T, run_lengths[UP].T, run_lengths[DOWN].T)
+        rows, cols = rng.integers(0, colors.shape[0], 20), rng.integers(0, colors.shape[1] - 1, 20)
+        swap_colors = rng.integers(0, 6, 20).astype(np.int8)
+        expected = match_counts_numpy(colors, run_lengths, rows, cols, swap_colors, rows, cols + 1)
+        assert np.array_equal(match_counts(colors, run_lengths, rows, cols, swap_colors, rows, cols + 1), expected), f"match counts differ on\n{colors}"
+
+
+@pytest.mark.parametrize('name', IMPLEMENTATIONS)
+def test_resolve_cascade(name):
+    resolve_cascade = IMPLEMENTATIONS[name][1]
+    for _, colors in random_boards():
+        expected_colors = colors.copy()
+        expected_by_color, expected_by_column = np.zeros(len(GEM_COLORS), dtype=np.int64), np.zeros(colors.shape[1], dtype=np.int64)
+        expected_depth = resolve_cascade_numpy(expected_colors, expected_by_color, expected_by_column)
+
+        result_colors = colors.copy()
+        by_color, by_column = np.zeros(len(GEM_COLORS), dtype=np.int64), np.zeros(colors.shape[1], dtype=np.int64)
+        depth = resolve_cascade(result_colors, by_color, by_column)
+        assert depth == expected_depth, f"cascade depth differs on\n{colors}"
+        assert np.array_equal(result_colors, expected_colors), f"board after the cascade differs on\n{colors}"
+        assert np.array_equal(by_color, expected_by_color) and np.array_equal(by_column, expected_by_column), f"cleared gems differ on\n{colors}"
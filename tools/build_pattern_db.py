@@ -0,0 +1,62 @@
+"""
+Build the pattern database of direct matches (see pattern_db.py) - run it once, the bot then only memory-maps the result.
+
+Usage: python tools/build_pattern_db.py
+"""
+from pathlib import Path
+import sys
+from typing import Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # allow imports of the bot modules
+
+from board import Board, Gem
+from config import GEM_COLORS, PATTERN_DB_FILE
+from move_calculator import BoardSimulator
+from pattern_db import EDGE_BITS, LEFT_RIGHT_MIRROR, PATTERN_COUNT, SAME_COLOR_BIT, UP_DOWN_MIRROR, X_OFFSETS, Y_OFFSETS, mirror_pattern
+
+WINDOW_SIZE = (5, 6)
+P1, P2 = (2, 2), (2, 3)  # positions of the swapped gems in the window
+
+
+def compute_pattern(pattern: int) -> Tuple[int, int, int]:
+    """Compute (count at p1, count at p2, exact) of a pattern on a board of the window size, other cells are unknown."""
+    color1 = GEM_COLORS[0]  # moves to p1
+    color2 = color1 if pattern >> SAME_COLOR_BIT & 1 else GEM_COLORS[2]  # moves to p2
+    grid = np.empty(WINDOW_SIZE, dtype=object)
+    grid[P1], grid[P2] = Gem(color2, P1), Gem(color1, P2)
+    for offsets, color, first_bit in ((X_OFFSETS, color1, 0), (Y_OFFSETS, color2, len(X_OFFSETS))):
+        for bit, (row_offset, col_offset) in enumerate(offsets, start=first_bit):
+            if pattern >> bit & 1:
+                position = (P1[0] + row_offset, P1[1] + col_offset)
+                grid[position] = Gem(color, position)
+    board = Board(WINDOW_SIZE)
+    board.update(grid)
+
+    count1 = BoardSimulator(board).get_match_count(P1, GEM_COLORS.index(color1), P2)
+    count2 = BoardSimulator(board).get_match_count(P2, GEM_COLORS.index(color2), P1)
+    exact = not any(pattern >> inner & 1 and pattern >> outer & 1 for inner, outer in EDGE_BITS)
+    return count1, count2, int(exact)
+
+
+def build_pattern_db() -> np.ndarray:
+    table = np.zeros((PATTERN_COUNT, 3), dtype=np.int8)
+    canonical_outcomes = {}
+    for pattern in range(PATTERN_COUNT):
+        up_down = mirror_pattern(pattern, UP_DOWN_MIRROR)
+        left_right = mirror_pattern(pattern, LEFT_RIGHT_MIRROR)
+        canonical = min(pattern, up_down, left_right, mirror_pattern(up_down, LEFT_RIGHT_MIRROR))
+        if canonical not in canonical_outcomes:
+            canonical_outcomes[canonical] = compute_pattern(canonical)
+        count1, count2, exact = canonical_outcomes[canonical]
+        if canonical not in (pattern, up_down):
+            count1, count2 = count2, count1  # the canonical pattern is left-right mirrored, so the swapped gems are too
+        table[pattern] = count1, count2, exact
+    print(f"Computed {len(canonical_outcomes)} canonical patterns of {PATTERN_COUNT}")
+    return table
+
+
+if __name__ == "__main__":
+    np.save(PATTERN_DB_FILE, build_pattern_db())
+    print(f"Pattern database saved to {PATTERN_DB_FILE}")
@@ -0,0 +1,175 @@
+"""
+Calibration tool - finds the board and measures gem colors in a screenshot of the game and saves them as a calibration profile,
+which is loaded by the bot at startup (instead of the hand-measured BOARD_REGION and GemColorCentroids in config.py).
+An existing profile is not applied (see config.apply_calibration), so a stale one can simply be replaced.
+Run it again whenever the resolution or UI scale changes.
+
+Usage: python tools/calibrate.py [screenshot.png]  (if no screenshot is given, the whole screen is captured)
+"""
+from pathlib import Path
+import sys
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # allow imports of the bot modules
+
+from board import Board
+from calibration import CalibrationProfile
+from colors import Color
+from config import BOARD_SIZE, CALIBRATION_FILE, CLASSIFIER_MAX_DISTANCE, CLASSIFIER_MIN_CONFIDENCE, GemColor, GemColorCentroids, validate_config
+from gem_classifier import CentroidGemClassifier, rgb_to_lab
+
+
+def load_screenshot(image_path: Optional[str]) -> np.ndarray:
+    """Load the screenshot in RGB order, or capture the whole screen if no path is given."""
+    if image_path:
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Can't load image {image_path}")
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    import pyautogui
+    return np.array(pyautogui.screenshot())
+
+
+def _find_grid_axis(profile: np.ndarray, cells: int, min_period: int, max_period: int) -> Tuple[int, int, float]:
+    """
+    Find a periodic grid of `cells` cells in a 1D profile (amount of gems in each column/row of the image). Gems are in the middle
+    of cells and there are gaps between them, so the best grid has the highest difference between cell centers and cell borders.
+
+    Returns:
+        (offset, period, score) of the best grid
+    """
+    cumsum = np.concatenate([[0], np.cumsum(profile)])
+    best = (0, 0, -np.inf)
+    for period in range(min_period, min(max_period, len(profile) // cells) + 1):
+        offsets = np.arange(0, len(profile) - cells * period + 1)
+        starts = offsets[:, np.newaxis] + np.arange(cells) * period  # (offsets, cells) start of each cell
+        quarter, eighth = max(period // 4, 1), max(period // 8, 1)
+        centers = (cumsum[starts + period // 2 + quarter] - cumsum[starts + period // 2 - quarter]) / (2 * quarter)
+        borders = np.concatenate([starts, starts[:, -1:] + period], axis=1)  # cells + 1 borders
+        border_sums = cumsum[np.minimum(borders + eighth, len(profile))] - cumsum[np.maximum(borders - eighth, 0)]
+        score = centers.mean(axis=1) - (border_sums / (2 * eighth)).mean(axis=1)
+        index = int(np.argmax(score))
+        if score[index] > best[2]:
+            best = (int(offsets[index]), period, float(score[index]))
+    return best
+
+
+def find_board_region(screenshot: np.ndarray, board_size: Tuple[int, int] = BOARD_SIZE, min_gem_size: int = 16) -> Tuple[int, int, int, int]:
+    """
+    Locate the board (grid of gems) in a full screenshot (RGB) by searching for a periodic grid of colorful gems at all scales.
+
+    Returns:
+        (left, top, width, height) of the board
+    """
+    hsv = cv2.cvtColor(screenshot, cv2.COLOR_RGB2HSV)
+    gems = ((hsv[..., 1] > 80) & (hsv[..., 2] > 50)).astype(np.float32)  # gems are saturated, the board background is dark and gray
+    height, width = gems.shape
+    cols, rows = board_size
+
+    # search columns and rows separately, then refine each axis only in the area of the board found on the other axis
+    left, gem_width, _ = _find_grid_axis(gems.mean(axis=0), cols, min_gem_size, width // cols)
+    top, gem_height, _ = _find_grid_axis(gems[:, left:left + cols * gem_width].mean(axis=1), rows, min_gem_size, height // rows)
+    left, gem_width, _ = _find_grid_axis(gems[top:top + rows * gem_height].mean(axis=0), cols, min_gem_size, width // cols)
+    return left, top, cols * gem_width, rows * gem_height
+
+
+def derive_gem_centroids(board_screenshot: np.ndarray, board_size: Tuple[int, int] = BOARD_SIZE,
+                         initial_centroids: dict[GemColor, list[Color]] = GemColorCentroids, iterations: int = 10
+                         ) -> Tuple[dict[GemColor, list[Color]], np.ndarray]:
+    """
+    Cluster average colors of all cells into the gem colors (k-means in CIELAB, seeded by the current centroids of gems, so each
+    cluster keeps its gem color). Cells too far from all clusters are special gems - they glow, which changes their lightness and
+    saturation, but not the hue, so each of them becomes a centroid of the special gem of the cluster with the nearest hue.
+    Special gems closer than CLASSIFIER_MAX_DISTANCE / 2 to each other are merged to one centroid.
+    Gem colors without any cell on the board keep their current centroids.
+
+    Returns:
+        (new centroids, average colors of cells (rows, cols, 3))
+    """
+    average_colors = Board((board_size[1], board_size[0])).get_cell_average_colors(board_screenshot)
+    cell_colors = average_colors.reshape(-1, 3)
+    cell_lab = rgb_to_lab(cell_colors)
+    gem_colors = [color for color in GemColor if initial_centroids[color]]
+    seeds = rgb_to_lab(np.array([initial_centroids[color][0].as_rgb_tuple() for color in gem_colors], dtype=np.float32))
+
+    for _ in range(iterations):
+        distances = np.linalg.norm(cell_lab[:, np.newaxis] - seeds[np.newaxis], axis=2)
+        nearest = np.argmin(distances, axis=1)
+        assigned = distances[np.arange(len(cell_lab)), nearest] <= CLASSIFIER_MAX_DISTANCE
+        for cluster in range(len(seeds)):
+            members = assigned & (nearest == cluster)
+            if members.any():
+                seeds[cluster] = cell_lab[members].mean(axis=0)
+
+    centroids = dict(initial_centroids)
+    hue_difference = np.angle(np.exp(1j * (np.arctan2(cell_lab[:, 2], cell_lab[:, 1])[:, np.newaxis] - np.arctan2(seeds[:, 2], seeds[:, 1]))))
+    nearest_hue = np.argmin(np.abs(hue_difference), axis=1)
+    for cluster, color in enumerate(gem_colors):
+        members = assigned & (nearest == cluster)
+        if members.any():
+            centroids[color] = [Color(*cell_colors[members].mean(axis=0))]
+
+        special_color = GemColor.__members__.get(f'{color}_special')
+        special_cells = np.flatnonzero(~assigned & (nearest_hue == cluster))
+        if special_color and special_color not in gem_colors and special_cells.size:  # measured special gems are clustered as other gems
+            groups: list[list[int]] = []  # similar special cells, each group is compared by its first cell
+            for cell in special_cells:
+                group = next((group for group in groups if np.linalg.norm(cell_lab[group[0]] - cell_lab[cell]) <= CLASSIFIER_MAX_DISTANCE / 2), None)
+                if group:
+                    group.append(cell)
+                else:
+                    groups.append([cell])
+            centroids[special_color] = [Color(*cell_colors[group].mean(axis=0)) for group in groups]
+    return centroids, average_colors
+
+
+def calibrate(screenshot: np.ndarray, source: str = '') -> CalibrationProfile:
+    """Create a validated calibration profile from a full screenshot (RGB)."""
+    board_region = find_board_region(screenshot)
+    print("Board found at left={}, top={}, width={}, height={}".format(*board_region))
+    return calibrate_region(screenshot, board_region, source)[0]
+
+
+def calibrate_region(screenshot: np.ndarray, board_region: Tuple[int, int, int, int], source: str = '') -> Tuple[CalibrationProfile, np.ndarray]:
+    """
+    Create a validated calibration profile of the board in the given region (left, top, width, height) of a full screenshot (RGB).
+
+    Returns:
+        (profile, average colors of cells (rows, cols, 3))
+    """
+    left, top, width, height = board_region
+    board_screenshot = screenshot[top:top + height, left:left + width]
+    centroids, average_colors = derive_gem_centroids(board_screenshot)
+
+    # validate - all cells of the screenshot must be recognized with the new centroids (special gems are fine to be unknown)
+    labels, confidence = CentroidGemClassifier(centroids).classify(average_colors)
+    for row, col in np.argwhere(confidence < CLASSIFIER_MIN_CONFIDENCE):
+        print(f"Warning: cell ({row}, {col}) with color {Color(*average_colors[row, col])} is not recognized reliably "
+              f"(confidence {confidence[row, col]:.2f})")
+    if np.count_nonzero(confidence >= CLASSIFIER_MIN_CONFIDENCE) < labels.size // 2:
+        raise ValueError("Most of the cells are not recognized, the board was probably not found properly. Try another screenshot.")
+
+    profile = CalibrationProfile(
+        board_region=(left, top, width, height),
+        board_size=BOARD_SIZE,
+        gem_centroids={str(color): color_centroids for color, color_centroids in centroids.items()},
+        source=source,
+    )
+    return profile, average_colors
+
+
+def main(image_path: Optional[str] = None) -> None:
+    validate_config()
+    screenshot = load_screenshot(image_path)
+    profile = calibrate(screenshot, source=image_path or 'screen')
+    for color, centroids in profile.gem_centroids.items():
+        print(f"{color:18} {', '.join(str(centroid) for centroid in centroids)}")
+    profile.save(CALIBRATION_FILE)
+    print(f"Calibration saved to {CALIBRATION_FILE}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,46 +1,68 @@
+"""
+Image area selector - shows a screenshot, lets you select a rectangle and prints its coordinates (in pixels of the screenshot).
+The selected rectangle can be exported as the board region of a calibration profile (see tools/calibrate.py).
+
+Usage: python tools/img_area_selector.py [screenshot.png]  (if no screenshot is given, the whole screen is captured)
+"""
 from pathlib import Path
 import sys
 import cv2
 import numpy as np
-import pyautogui
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # allow imports of the bot modules
+
+from calibrate import calibrate_region, load_screenshot
+from colors import Color
+from config import CALIBRATION_FILE, validate_config
+
+MAX_VIEW_SIZE = (1600, 900)  # (width, height) the screenshot is scaled down to fit the window
+ZOOM_STEP = 1.1  # zoom factor of one mouse wheel step
+MAX_ZOOM = 8.0  # the most screenshot pixels shown by one window pixel is 1 / MAX_ZOOM
+
 
 class ImageAreaSelector:
     def __init__(self, image_path: Optional[str] = None):
-        self.image = self.load_image(image_path)
-        self.original_image = self.image.copy()
+        self.image_path = image_path
         self.window_name = "Image Area Selector"
+        self.load_image(load_screenshot(image_path))
+
+    def load_image(self, rgb_image: np.ndarray) -> None:
+        """Show a new screenshot (RGB), build its zoom pyramid and reset the view and selection."""
+        self.rgb_image = rgb_image
+        height, width = rgb_image.shape[:2]
+        self.fit_scale = max(width / MAX_VIEW_SIZE[0], height / MAX_VIEW_SIZE[1], 1.0)  # screenshot pixels per window pixel
+        self.view_size = (round(width / self.fit_scale), round(height / self.fit_scale))
+
+        # level k is the screenshot downscaled 2^k times, the view is rendered from the smallest level with enough detail
+        self.pyramid: List[np.ndarray] = [cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)]
+        while 2 ** len(self.pyramid) <= self.fit_scale:
+            self.pyramid.append(cv2.pyrDown(self.pyramid[-1]))
+
+        self.scale = self.fit_scale
+        self.view_origin = (0.0, 0.0)  # screenshot coordinates of the top left corner of the window
+        self.view_image: Optional[np.ndarray] = None  # rendered view without overlays, rendered again only after zoom
+        self.mouse_position: Optional[Tuple[int, int]] = None  # screenshot coordinates of the mouse
         self.start_point = None
         self.end_point = None
-        self.zoomed = False
-        self.zoom_factor = 1.0
-        self.zoom_center = None
         self.rmb_first_point = None
         self.selected_rectangle = None
-
-    def load_image(self, image_path: Optional[str]):
-        if image_path:
-            return cv2.imread(image_path)
-        screenshot = pyautogui.screenshot()
-        return cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+        self.dirty = True  # the window must be redrawn
 
     def take_new_screenshot(self) -> None:
-        self.image = np.array(pyautogui.screenshot())
-        self.original_image = self.image.copy()
-        self.zoomed = False
-        self.zoom_factor = 1.0
-        self.zoom_center = None
-        self.start_point = None
-        self.end_point = None
-        self.rmb_first_point = None
-        self.selected_rectangle = None
+        self.image_path = None
+        self.load_image(load_screenshot(None))
 
     def mouse_callback(self, event: int, x: int, y: int, flags: int, param: None) -> None:
         image_x, image_y = self.screen_to_image_coords(x, y)
-        if event == cv2.EVENT_LBUTTONDOWN:
+        if event == cv2.EVENT_MOUSEMOVE:
+            self.mouse_position = (image_x, image_y)
+            if self.start_point:
+                self.end_point = (image_x, image_y)  # rectangle follows the mouse while dragging
+        elif event == cv2.EVENT_LBUTTONDOWN:
             self.start_point = (image_x, image_y)
             self.selected_rectangle = None
-        elif event == cv2.EVENT_LBUTTONUP:
+        elif event == cv2.EVENT_LBUTTONUP and self.start_point:
             self.end_point = (image_x, image_y)
             self.print_rectangle_info()
             self.selected_rectangle = (self.start_point, self.end_point)
@@ -59,51 +81,80 @@ class ImageAreaSelector:
                 self.start_point = None
                 self.end_point = None
         elif event == cv2.EVENT_MOUSEWHEEL:
-            if flags > 0:
-                self.zoom_in(x, y)
-            else:
-                self.zoom_out(x, y)
+            self.zoom(x, y, ZOOM_STEP if flags > 0 else 1 / ZOOM_STEP)
+        else:
+            return
+        self.dirty = True
 
     def screen_to_image_coords(self, x: int, y: int) -> Tuple[int, int]:
-        if self.zoom_center is None:
-            return x, y
-        image_x = int(self.zoom_center[0] + (x - self.image.shape[1] / 2) / self.zoom_factor)
-        image_y = int(self.zoom_center[1] + (y - self.image.shape[0] / 2) / self.zoom_factor)
-        return image_x, image_y
-
-    def zoom_in(self, x: int, y: int) -> None:
-        self.zoom_factor *= 1.1
-        self.zoomed = True
-        self.update_zoomed_image(x, y)
-
-    def zoom_out(self, x: int, y: int) -> None:
-        self.zoom_factor /= 1.1
-        if self.zoom_factor < 1.0:
-            self.zoom_factor = 1.0
-            self.zoomed = False
-            self.zoom_center = None
-        self.update_zoomed_image(x, y)
-
-    def update_zoomed_image(self, x: int, y: int) -> None:
-        height, width = self.original_image.shape[:2]
-        
-        if self.zoom_center is None:
-            self.zoom_center = (width // 2, height // 2)
-        
-        mouse_x, mouse_y = self.screen_to_image_coords(x, y)
-        
-        new_width = int(width / self.zoom_factor)
-        new_height = int(height / self.zoom_factor)
-        
-        left = max(0, int(mouse_x - new_width / 2))
-        top = max(0, int(mouse_y - new_height / 2))
-        right = min(width, left + new_width)
-        bottom = min(height, top + new_height)
-        
-        self.zoom_center = ((left + right) // 2, (top + bottom) // 2)
-        
-        cropped = self.original_image[top:bottom, left:right]
-        self.image = cv2.resize(cropped, (width, height), interpolation=cv2.INTER_LINEAR)
+        return int(self.view_origin[0] + x * self.scale), int(self.view_origin[1] + y * self.scale)
+
+    def image_to_screen_coords(self, x: int, y: int) -> Tuple[int, int]:
+        return round((x - self.view_origin[0]) / self.scale), round((y - self.view_origin[1]) / self.scale)
+
+    def zoom(self, x: int, y: int, factor: float) -> None:
+        """Zoom the view by the factor, the screenshot point under the mouse (x, y) stays in place."""
+        image_x, image_y = self.view_origin[0] + x * self.scale, self.view_origin[1] + y * self.scale
+        self.scale = min(max(self.scale / factor, 1 / MAX_ZOOM), self.fit_scale)
+        height, width = self.rgb_image.shape[:2]
+        self.view_origin = (min(max(image_x - x * self.scale, 0), width - self.view_size[0] * self.scale),
+                            min(max(image_y - y * self.scale, 0), height - self.view_size[1] * self.scale))
+        self.view_image = None
+
+    def render_view(self) -> np.ndarray:
+        """Render the visible part of the screenshot to the window size from the smallest pyramid level with enough detail."""
+        level = min(int(np.log2(max(self.scale, 1))), len(self.pyramid) - 1)
+        level_scale = 2 ** level
+        source = self.pyramid[level]
+        left, top = self.view_origin[0] / level_scale, self.view_origin[1] / level_scale
+        right, bottom = left + self.view_size[0] * self.scale / level_scale, top + self.view_size[1] * self.scale / level_scale
+        cropped = source[int(top):min(int(np.ceil(bottom)), source.shape[0]), int(left):min(int(np.ceil(right)), source.shape[1])]
+        # the level is downscaled less than 2x more, so linear interpolation doesn't alias; zoomed in - show the pixels sharp
+        interpolation = cv2.INTER_NEAREST if self.scale < 1 else cv2.INTER_LINEAR
+        return cv2.resize(cropped, self.view_size, interpolation=interpolation)
+
+    def draw(self) -> np.ndarray:
+        if self.view_image is None:
+            self.view_image = self.render_view()
+        display_image = self.view_image.copy()
+
+        if self.start_point:
+            cv2.circle(display_image, self.image_to_screen_coords(*self.start_point), 3, (0, 255, 0), -1)
+        if self.start_point and self.end_point:
+            cv2.rectangle(display_image, self.image_to_screen_coords(*self.start_point), self.image_to_screen_coords(*self.end_point), (0, 255, 0), 2)
+        if self.rmb_first_point:
+            cv2.circle(display_image, self.image_to_screen_coords(*self.rmb_first_point), 3, (0, 0, 255), -1)
+        if self.selected_rectangle:
+            start, end = self.selected_rectangle
+            cv2.rectangle(display_image, self.image_to_screen_coords(*start), self.image_to_screen_coords(*end), (0, 255, 0), 2)
+        if self.mouse_position:
+            cv2.putText(display_image, f"Image coords: {self.mouse_position[0]}, {self.mouse_position[1]}", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        return display_image
+
+    def get_selected_region(self) -> Optional[Tuple[int, int, int, int]]:
+        """Return the selected rectangle as (left, top, width, height), or None if nothing is selected."""
+        if not self.selected_rectangle:
+            return None
+        (x1, y1), (x2, y2) = self.selected_rectangle
+        return min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1)
+
+    def export_calibration(self) -> None:
+        """Save the selected rectangle as the board region of a calibration profile, with gem colors measured in it."""
+        board_region = self.get_selected_region()
+        if not board_region:
+            print("Select the board first")
+            return
+        try:
+            profile, average_colors = calibrate_region(self.rgb_image, board_region, source=str(self.image_path or 'screen'))
+        except ValueError as error:
+            print(f"Calibration failed: {error}")
+            return
+        print("Average colors of cells (RGB):")
+        for row in average_colors:
+            print(' '.join(Color(*color).as_rgb_hex() for color in row))
+        profile.save(CALIBRATION_FILE)
+        print(f"Calibration of board region {board_region} saved to {CALIBRATION_FILE}")
 
     def print_rectangle_info(self) -> None:
         if self.start_point and self.end_point:
@@ -122,59 +173,28 @@ class ImageAreaSelector:
         print("- Right Mouse Button: Click once to set point1, click again to set point2 of rectangle area")
         print("- Mouse Wheel: Zoom in/out")
         print("- N (or n): Take a new screenshot")
+        print(f"- C (or c): Export the selected rectangle as the board region of the calibration ({CALIBRATION_FILE})")
         print("- ESC: Exit")
 
         while True:
-            display_image = self.image.copy()
-            
-            if self.start_point:
-                start_x, start_y = self.start_point
-                cv2.circle(display_image, (int(start_x), int(start_y)), 3, (0, 255, 0), -1)
-            
-            if self.start_point and self.end_point:
-                start_x, start_y = self.start_point
-                end_x, end_y = self.end_point
-                cv2.rectangle(display_image, 
-                              (int(start_x), int(start_y)),
-                              (int(end_x), int(end_y)),
-                              (0, 255, 0), 2)
-
-            if self.rmb_first_point:
-                rmb_x, rmb_y = self.rmb_first_point
-                cv2.circle(display_image, (int(rmb_x), int(rmb_y)), 3, (0, 0, 255), -1)
-
-            if self.selected_rectangle:
-                start_x, start_y = self.selected_rectangle[0]
-                end_x, end_y = self.selected_rectangle[1]
-                cv2.rectangle(display_image,
-                              (int(start_x), int(start_y)),
-                              (int(end_x), int(end_y)),
-                              (0, 255, 0), 2)
-
-            mouse_pos = pyautogui.position()
-            window_pos = cv2.getWindowImageRect(self.window_name)
-            if window_pos:
-                relative_x = mouse_pos.x - window_pos[0]
-                relative_y = mouse_pos.y - window_pos[1]
-                image_x, image_y = self.screen_to_image_coords(relative_x, relative_y)
-                cv2.putText(display_image, f"Image coords: {image_x}, {image_y}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-
-            cv2.imshow(self.window_name, display_image)
-
-            key = cv2.waitKey(1) & 0xFF
+            if self.dirty:  # redraw only after a change, not on every tick
+                cv2.imshow(self.window_name, self.draw())
+                self.dirty = False
+
+            key = cv2.waitKey(15) & 0xFF
             if key == 27:  # ESC key
                 break
             elif key in [ord('n'), ord('N')]:
                 self.take_new_screenshot()
+            elif key in [ord('c'), ord('C')]:
+                self.export_calibration()
 
         cv2.destroyAllWindows()
 
 def main(image_path: Optional[str] = None) -> None:
+    validate_config()
     selector = ImageAreaSelector(image_path)
     selector.run()
 
 if __name__ == "__main__":
-    image_path = sys.argv[1] if len(sys.argv) > 1 else None
-    image_path = Path(image_path).resolve()
-    main(image_path)
+    main(str(Path(sys.argv[1]).resolve()) if len(sys.argv) > 1 else None)
@@ -0,0 +1,50 @@
+"""
+Replay a slow frame dumped by the slow-frame profiler (see profiler.py) - parse its screenshot and search for the best move again,
+with timing and a cProfile report of both phases.
+
+Usage: python tools/replay_frame.py profiles/<timestamp>
+"""
+import cProfile
+from pathlib import Path
+import pstats
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # allow imports of the bot modules
+
+from board import Board
+from config import BOARD_SIZE, apply_calibration
+from move_calculator import MoveCalculator
+
+
+def replay_frame(directory: Path) -> None:
+    screenshot = cv2.cvtColor(cv2.imread(str(directory / 'screenshot.png')), cv2.COLOR_BGR2RGB)
+    recorded_colors = np.load(directory / 'board.npy')
+    apply_calibration()  # the frame was parsed with the calibrated gem colors
+    board = Board(BOARD_SIZE)
+    move_calculator = MoveCalculator()
+    print((directory / 'phases.txt').read_text())
+    board.update_from_screenshot(screenshot)
+    move_calculator.find_best_move(board)  # warm-up (compiled kernels are loaded on the first call), the replay measures the steady state
+
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    profile.runcall(board.update_from_screenshot, screenshot)
+    parsed = time.perf_counter()
+    best_move = profile.runcall(move_calculator.find_best_move, board)
+    searched = time.perf_counter()
+
+    print(f"Replay: parse {(parsed - start) * 1000:.1f} ms, search {(searched - parsed) * 1000:.1f} ms, best move {best_move}")
+    if not np.array_equal(board.colors, recorded_colors):
+        print(f"Parsed board differs from the recorded one:\n{board}\nRecorded:\n{(directory / 'board.txt').read_text()}")
+    pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    replay_frame(Path(sys.argv[1]))